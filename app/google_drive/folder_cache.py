@@ -0,0 +1,83 @@
+import threading
+import time
+
+from app.utils.json_file import read_json_file, write_json_file
+
+
+class FolderCache:
+    def __init__(self, path: str | None = None, ttl: float = 86400):
+        """
+        Cache of Drive folder IDs keyed by their parent folder ID and name, so resolving a
+        known folder costs no requests. Entries expire after the TTL, are dropped when Drive
+        reports the folder is gone, and are persisted to a JSON file if a path is given
+
+        :param path: The JSON file where the cache is persisted. If None, it is only kept in memory
+        :param ttl: The seconds an entry is valid
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[str, float]] = {
+            key: tuple(value) for key, value in read_json_file(path, {}).items()
+        }
+
+    @staticmethod
+    def _key(parent_folder_id: str, folder_name: str) -> str:
+        return f"{parent_folder_id}/{folder_name}"
+
+    def get(self, parent_folder_id: str, folder_name: str) -> str | None:
+        """
+        Get the ID of a folder
+
+        :param parent_folder_id: The ID of the parent folder
+        :param folder_name: The name of the folder
+        :return: The folder ID, or None if it is not cached or expired
+        """
+        key = self._key(parent_folder_id, folder_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            folder_id, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            return folder_id
+
+    def set(self, parent_folder_id: str, folder_name: str, folder_id: str) -> None:
+        """
+        Cache the ID of a folder
+
+        :param parent_folder_id: The ID of the parent folder
+        :param folder_name: The name of the folder
+        :param folder_id: The ID of the folder
+        :return: None
+        """
+        with self._lock:
+            self._entries[self._key(parent_folder_id, folder_name)] = (folder_id, time.time() + self.ttl)
+            self._save()
+
+    def invalidate(self, folder_id: str) -> None:
+        """
+        Drop a folder and everything cached below it, used when Drive no longer finds the folder
+
+        :param folder_id: The ID of the folder
+        :return: None
+        """
+        with self._lock:
+            stale = {folder_id}
+            while True:
+                keys = [
+                    key for key, (cached_id, _) in self._entries.items()
+                    if cached_id in stale or key.split("/", 1)[0] in stale
+                ]
+                if not keys:
+                    break
+                for key in keys:
+                    stale.add(self._entries.pop(key)[0])
+            self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        write_json_file(self.path, self._entries)
@@ -1,26 +1,110 @@
+import io
+import json
+import logging
 import os
 import base64
+import hashlib
+import random
+import threading
+import time
+from collections.abc import Callable
+from typing import BinaryIO, TypeVar
+from concurrent.futures import ThreadPoolExecutor
 
+import google_auth_httplib2
+import httplib2
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaFileUpload, MediaIoBaseUpload
 
+from app.google_drive.folder_cache import FolderCache
+from app.google_drive.uploads import ResumableUploads
+from app.logs import request_id
+from app.metrics import drive_call
 from app.models import UploadScreenshot
 
 
+logger = logging.getLogger(__name__)
+
+RESUMABLE_UPLOAD_URL = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id"
+
+T = TypeVar("T")
+
+
 class GoogleDriveService:
     def __init__(self):
-        creds = service_account.Credentials.from_service_account_file(
+        self.creds = service_account.Credentials.from_service_account_file(
             'serviceAccount.json',
             scopes=['https://www.googleapis.com/auth/drive']
         )
-        self.drive = build('drive', 'v3', credentials=creds)
+        self.drive = build('drive', 'v3', credentials=self.creds)
         self.parent_folder_id = os.getenv("GOOGLE_DRIVE_PARENT_FOLDER_ID")
+        self.upload_workers = int(os.getenv("DRIVE_UPLOAD_WORKERS", 8))
+        # Retries of rate limited (429 / 403 rateLimitExceeded) and 5xx responses, with randomized exponential backoff
+        self.num_retries = int(os.getenv("DRIVE_NUM_RETRIES", 5))
+        self._local = threading.local()
+        # Files bigger than a chunk are sent with resumable uploads. Drive requires multiples of 256 KB
+        chunk_size = int(os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", 5 * 1024 * 1024))
+        self.chunk_size = max(chunk_size // (256 * 1024), 1) * 256 * 1024
+        self.resumable_uploads = ResumableUploads(
+            os.getenv("DRIVE_UPLOAD_STATE_FILE", "screenshots/.resumable_uploads.json")
+        )
+        # Called with the file name, the bytes Drive has and the size after each chunk of a resumable
+        # upload. Replace it to report the progress somewhere else
+        self.on_upload_progress: Callable[[str, int, int], None] | None = self._log_upload_progress
+        # Drive ID of a Colab template to copy, which unlike uploading Template.ipynb can be batched
+        self.template_file_id = os.getenv("GOOGLE_DRIVE_TEMPLATE_FILE_ID")
+        self.folder_cache = FolderCache(
+            os.getenv("DRIVE_FOLDER_CACHE_FILE", "screenshots/.folder_ids.json"),
+            ttl=float(os.getenv("DRIVE_FOLDER_CACHE_TTL", 86400)),
+        )
 
-    def _create_colab_template(self, task_id: str, model: str, folder: str) -> str:
-        file = self._get_or_create_file(f"{task_id}_{model}.ipynb", "Template.ipynb", folder)
-        print(f"File {model}: https://colab.research.google.com/drive/{file}")
-        return file
+    def _http(self) -> google_auth_httplib2.AuthorizedHttp:
+        # httplib2 is not thread-safe, so each thread sends its requests through its own connection
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http())
+        return http
+
+    def _execute(self, request: HttpRequest) -> dict:
+        with drive_call(request.methodId):
+            return request.execute(http=self._http(), num_retries=self.num_retries)
+
+    def _execute_batch(self, requests: dict[str, HttpRequest]) -> dict[str, dict]:
+        """
+        Send independent requests in a single batch round trip, retried like _execute when the whole
+        batch fails. The ones that fail inside the batch (e.g. rate limited) are sent again one by one
+        with retries
+
+        :param requests: The requests keyed by an ID
+        :return: The responses keyed by the request ID
+        """
+        if len(requests) <= 1:
+            return {key: self._execute(request) for key, request in requests.items()}
+
+        with drive_call("batch"):
+            responses, failed = self._retry(lambda: self._send_batch(requests))
+        for key in failed:
+            responses[key] = self._execute(requests[key])
+        return responses
+
+    def _send_batch(self, requests: dict[str, HttpRequest]) -> tuple[dict[str, dict], list[str]]:
+        # A new batch each time, so a retried round trip starts without the responses of the failed one
+        responses = {}
+        failed = []
+
+        def callback(key: str, response: dict, exception: Exception | None):
+            if exception is None:
+                responses[key] = response
+            else:
+                failed.append(key)
+
+        batch = self.drive.new_batch_http_request(callback=callback)
+        for key, request in requests.items():
+            batch.add(request, request_id=key)
+        batch.execute(http=self._http())
+        return responses, failed
 
     def _create_folder(self, folder_name: str, parent_folder_id: str = None):
         folder_metadata = {
@@ -28,59 +112,311 @@ class GoogleDriveService:
             "mimeType": "application/vnd.google-apps.folder",
             'parents': [parent_folder_id] if parent_folder_id else None
         }
-        folder = self.drive.files().create(body=folder_metadata, fields='id').execute()
+        folder = self._execute(self.drive.files().create(body=folder_metadata, fields='id'))
         return folder['id']
 
-    def _create_file(self, file_name: str, file_path: str, parent_folder_id: str = None):
+    def _create_file(
+        self,
+        file_name: str,
+        file_path: str,
+        parent_folder_id: str = None,
+        content: bytes = None,
+        progress: Callable[[str, int, int], None] = None,
+    ):
         file_metadata = {
             'name': file_name,
             'parents': [parent_folder_id] if parent_folder_id else None
         }
         mimetype = "application/vnd.google.colaboratory" if file_name.endswith(".ipynb") else "image/png"
-        media = MediaFileUpload(file_path, mimetype=mimetype)
-        file = self.drive.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        if content is not None:
+            size = len(content)
+            version = hashlib.sha256(content).hexdigest()
+        else:
+            stat = os.stat(file_path)
+            size = stat.st_size
+            version = f"{size}-{stat.st_mtime_ns}"
+        if size <= self.chunk_size:
+            if content is not None:
+                media = MediaIoBaseUpload(io.BytesIO(content), mimetype=mimetype)
+            else:
+                media = MediaFileUpload(file_path, mimetype=mimetype)
+            file = self._execute(self.drive.files().create(body=file_metadata, media_body=media, fields='id'))
+        else:
+            upload_key = f"{parent_folder_id}/{file_name}/{version}"
+            progress = progress or self.on_upload_progress
+            if content is not None:
+                file = self._upload_resumable(file_metadata, mimetype, io.BytesIO(content), size, upload_key, progress)
+            else:
+                with open(file_path, "rb") as stream:
+                    file = self._upload_resumable(file_metadata, mimetype, stream, size, upload_key, progress)
         return file['id']
 
-    def _get_or_create_file(self, file_name: str, file_path: str, parent_folder_id: str = None):
-        file = self.drive.files().list(q=f"'{parent_folder_id}' in parents and name='{file_name}'").execute()
-        if file['files']:
-            return file['files'][0]['id']
-        else:
-            return self._create_file(file_name, file_path, parent_folder_id)
+    def _upload_resumable(
+        self,
+        file_metadata: dict,
+        mimetype: str,
+        stream: BinaryIO,
+        size: int,
+        upload_key: str,
+        progress: Callable[[str, int, int], None] = None,
+    ) -> dict:
+        """
+        Send a file chunk by chunk with the resumable upload protocol of Drive. The session URI is
+        persisted, so if the upload is interrupted (even by a restart) the next attempt of the same
+        file asks Drive how many bytes it already has and continues from there
 
-    def _get_or_create_folder(self, folder_name: str, parent_folder_id: str = None) -> tuple[str, bool]:
-        folder = self.drive.files().list(q=f"'{parent_folder_id}' in parents and name='{folder_name}'").execute()
-        if folder['files']:
-            return folder['files'][0]['id'], False
-        else:
-            return self._create_folder(folder_name, parent_folder_id), True
+        :param file_metadata: The metadata of the file
+        :param mimetype: The MIME type of the file
+        :param stream: The content of the file
+        :param size: The size of the file
+        :param upload_key: The key of the upload, unique for the parent folder, name and content
+        :param progress: Called with the file name, the bytes Drive has and the size after each chunk
+        :return: The created file
+        """
+        resumable_uri = self.resumable_uploads.get(upload_key)
+        offset, file = 0, None
+        if resumable_uri:
+            try:
+                offset, file = self._retry(lambda: self._upload_status(resumable_uri, size))
+            except HttpError as e:
+                if e.resp.status not in (404, 410):
+                    raise
+                # The session expired, so the upload starts over
+                self.resumable_uploads.pop(upload_key)
+                resumable_uri = None
+        if resumable_uri is None:
+            resumable_uri = self._retry(lambda: self._start_upload(file_metadata, mimetype, size))
+            self.resumable_uploads.set(upload_key, resumable_uri)
 
-    def _search_folder(self, folder_name: str, parent_folder_id: str = None):
-        folder = self.drive.files().list(q=f"'{parent_folder_id}' in parents and name='{folder_name}'").execute()
-        return folder['files'][0]['id'] if folder['files'] else None
+        failures = 0
+        while file is None:
+            stream.seek(offset)
+            chunk = stream.read(self.chunk_size)
+            headers = {
+                "Content-Length": str(len(chunk)),
+                "Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}",
+            }
+            try:
+                response, content = self._send_upload(resumable_uri, "PUT", chunk, headers)
+                offset, file = self._upload_offset(response, content, resumable_uri)
+            except (HttpError, OSError, httplib2.HttpLib2Error) as e:
+                if not self._is_retryable(e) or failures >= self.num_retries:
+                    raise
+                failures += 1
+                time.sleep(random.random() * 2 ** failures)
+                # Drive may have received part of the chunk
+                offset, file = self._retry(lambda: self._upload_status(resumable_uri, size))
+            if progress:
+                progress(file_metadata["name"], size if file is not None else offset, size)
+
+        self.resumable_uploads.pop(upload_key)
+        return file
+
+    @staticmethod
+    def _log_upload_progress(file_name: str, sent: int, size: int) -> None:
+        logger.debug("upload progress", extra={"data": {"file_name": file_name, "sent": sent, "size": size}})
+
+    def _send_upload(
+        self, uri: str, method: str, body: bytes | str = b"", headers: dict[str, str] = None
+    ) -> tuple[httplib2.Response, bytes]:
+        with drive_call("drive.files.create"):
+            return self._http().request(uri, method, body=body, headers=headers or {})
+
+    def _start_upload(self, file_metadata: dict, mimetype: str, size: int) -> str:
+        """
+        Start a resumable upload
+
+        :param file_metadata: The metadata of the file
+        :param mimetype: The MIME type of the file
+        :param size: The size of the file
+        :return: The session URI, where the chunks are sent
+        """
+        response, content = self._send_upload(
+            RESUMABLE_UPLOAD_URL,
+            "POST",
+            json.dumps(file_metadata),
+            {
+                "Content-Type": "application/json; charset=UTF-8",
+                "X-Upload-Content-Type": mimetype,
+                "X-Upload-Content-Length": str(size),
+            },
+        )
+        if response.status != 200:
+            raise HttpError(response, content, uri=RESUMABLE_UPLOAD_URL)
+        return response["location"]
+
+    def _upload_status(self, resumable_uri: str, size: int) -> tuple[int, dict | None]:
+        response, content = self._send_upload(
+            resumable_uri, "PUT", headers={"Content-Length": "0", "Content-Range": f"bytes */{size}"}
+        )
+        return self._upload_offset(response, content, resumable_uri)
+
+    @staticmethod
+    def _upload_offset(response: httplib2.Response, content: bytes, uri: str) -> tuple[int | None, dict | None]:
+        """
+        Read the response to a chunk or status request of a resumable upload
+
+        :param response: The response
+        :param content: The body of the response
+        :param uri: The session URI
+        :return: The offset of the next chunk, or the created file once the upload is complete
+        """
+        if response.status in (200, 201):
+            return None, json.loads(content)
+        if response.status == 308:
+            # Drive sends the received range, e.g. "bytes=0-262143", once it has the first byte
+            received = response.get("range")
+            return (int(received.rsplit("-", 1)[1]) + 1 if received else 0), None
+        raise HttpError(response, content, uri=uri)
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        return not isinstance(error, HttpError) or error.resp.status == 429 or error.resp.status >= 500
+
+    def _retry(self, send: Callable[[], T]) -> T:
+        # Same retries as _execute, for the round trips it does not cover: rate limited and 5xx responses and
+        # connection errors, with randomized exponential backoff
+        for attempt in range(self.num_retries + 1):
+            try:
+                return send()
+            except (HttpError, OSError, httplib2.HttpLib2Error) as e:
+                if not self._is_retryable(e) or attempt == self.num_retries:
+                    raise
+            time.sleep(random.random() * 2 ** (attempt + 1))
+
+    def _list_children(self, parent_folder_id: str) -> dict[str, str]:
+        response = self._execute(
+            self.drive.files().list(
+                q=f"'{parent_folder_id}' in parents and trashed=false", fields="files(id, name)", pageSize=1000
+            )
+        )
+        # Reversed so the first match wins, like the single name lookups
+        return {file['name']: file['id'] for file in reversed(response['files'])}
+
+    def _get_or_create_children(
+        self, parent_folder_id: str, folder_names: list[str], template_names: list[str] = None, is_new: bool = False
+    ) -> tuple[dict[str, str], bool]:
+        """
+        Get or create several folders and Colab templates inside a folder with a constant amount of
+        round trips: at most one list request and one batch of creations
+
+        :param parent_folder_id: The ID of the parent folder
+        :param folder_names: The names of the folders
+        :param template_names: The names of the Colab templates
+        :param is_new: If the parent was just created, so it has no children to look up
+        :return: The IDs keyed by name, and if any folder was created
+        """
+        names = [*folder_names, *(template_names or [])]
+        ids = {name: self.folder_cache.get(parent_folder_id, name) for name in names}
+        missing = [name for name, file_id in ids.items() if not file_id]
+        if missing and not is_new:
+            children = self._list_children(parent_folder_id)
+            for name in missing:
+                if name in children:
+                    ids[name] = children[name]
+                    self.folder_cache.set(parent_folder_id, name, children[name])
+            missing = [name for name in missing if not ids[name]]
+
+        requests = {}
+        uploads = []
+        for name in missing:
+            if name in folder_names:
+                requests[name] = self.drive.files().create(
+                    body={'name': name, "mimeType": "application/vnd.google-apps.folder", 'parents': [parent_folder_id]},
+                    fields='id',
+                )
+            elif self.template_file_id:
+                requests[name] = self.drive.files().copy(
+                    fileId=self.template_file_id, body={'name': name, 'parents': [parent_folder_id]}, fields='id'
+                )
+            else:
+                uploads.append(name)
+
+        # Media uploads can not go in a batch, so they run while the batch is sent
+        with ThreadPoolExecutor(max(len(uploads), 1), initializer=request_id.set, initargs=(request_id.get(),)) as executor:
+            uploaded = [executor.submit(self._create_file, name, "Template.ipynb", parent_folder_id) for name in uploads]
+            created = self._execute_batch(requests)
+            for name, future in zip(uploads, uploaded):
+                created[name] = {'id': future.result()}
+
+        for name, file in created.items():
+            ids[name] = file['id']
+            self.folder_cache.set(parent_folder_id, name, file['id'])
+        return ids, any(name in folder_names for name in created)
+
+    def _create_colab_templates(self, task_id: str, folder: str, is_new: bool = False) -> None:
+        names = {model: f"{task_id}_{model}.ipynb" for model in ("A", "B")}
+        ids, _ = self._get_or_create_children(folder, [], list(names.values()), is_new=is_new)
+        for model, name in names.items():
+            logger.info("colab template", extra={"data": {"model": model, "url": f"https://colab.research.google.com/drive/{ids[name]}"}})
+
+    def _get_or_create_folder(
+        self, folder_name: str, parent_folder_id: str = None, verify: bool = False
+    ) -> tuple[str, bool]:
+        folder_id = self._search_folder(folder_name, parent_folder_id, verify=verify)
+        if folder_id:
+            return folder_id, False
+        folder_id = self._create_folder(folder_name, parent_folder_id)
+        if parent_folder_id:
+            self.folder_cache.set(parent_folder_id, folder_name, folder_id)
+        return folder_id, True
+
+    def _search_folder(self, folder_name: str, parent_folder_id: str = None, verify: bool = False):
+        """
+        Get the ID of a folder from the cache, or from Drive if it is not cached
+
+        :param folder_name: The name of the folder
+        :param parent_folder_id: The ID of the parent folder
+        :param verify: Check that a cached folder was not deleted in Drive, which costs one request
+        :return: The folder ID, or None if it does not exist
+        """
+        if not parent_folder_id:
+            return None
+        folder_id = self.folder_cache.get(parent_folder_id, folder_name)
+        if folder_id:
+            if not verify or self._folder_exists(folder_id):
+                return folder_id
+            # Everything cached below the deleted folder is stale too
+            self.folder_cache.invalidate(folder_id)
+        folder = self._execute(
+            self.drive.files().list(q=f"'{parent_folder_id}' in parents and trashed=false and name='{folder_name}'")
+        )
+        if not folder['files']:
+            return None
+        folder_id = folder['files'][0]['id']
+        self.folder_cache.set(parent_folder_id, folder_name, folder_id)
+        return folder_id
+
+    def _folder_exists(self, folder_id: str) -> bool:
+        try:
+            folder = self._execute(self.drive.files().get(fileId=folder_id, fields="id, trashed"))
+        except HttpError as e:
+            if e.resp.status == 404:
+                return False
+            raise
+        return not folder.get("trashed", False)
 
     def create_task_files(self, task_id: str) -> None:
-        folder, _ = self._get_or_create_folder(task_id, self.parent_folder_id)
-        self._create_colab_template(task_id, "A", folder)
-        self._create_colab_template(task_id, "B", folder)
+        folder, created = self._get_or_create_folder(task_id, self.parent_folder_id)
+        self._create_colab_templates(task_id, folder, is_new=created)
 
     def create_task_folders(self, task_id: str, create_colab_template: bool = False) -> dict[str, str]:
         if not os.path.exists(f"screenshots/{task_id}"):
             os.makedirs(f"screenshots/{task_id}/model_a", exist_ok=True)
             os.makedirs(f"screenshots/{task_id}/model_b", exist_ok=True)
 
-        folder, created = self._get_or_create_folder(task_id, self.parent_folder_id)
-        screenshots_folder, _ = self._get_or_create_folder("screenshots", folder)
-
-        if create_colab_template:
-            self._create_colab_template(task_id, "A", folder)
-
-        model_a_folder, _ = self._get_or_create_folder("model_a", screenshots_folder)
+        # The folder IDs below the task are trusted once the task folder is known to still exist
+        folder, created = self._get_or_create_folder(task_id, self.parent_folder_id, verify=True)
+        templates = [f"{task_id}_{model}.ipynb" for model in ("A", "B")] if create_colab_template else []
+        ids, screenshots_created = self._get_or_create_children(folder, ["screenshots"], templates, is_new=created)
+        for model, name in zip(("A", "B"), templates):
+            logger.info("colab template", extra={"data": {"model": model, "url": f"https://colab.research.google.com/drive/{ids[name]}"}})
 
-        if create_colab_template:
-            self._create_colab_template(task_id, "B", folder)
-
-        model_b_folder, _ = self._get_or_create_folder("model_b", screenshots_folder)
+        screenshots_ids, _ = self._get_or_create_children(
+            ids["screenshots"], ["model_a", "model_b"], is_new=screenshots_created
+        )
+        model_a_folder = screenshots_ids["model_a"]
+        model_b_folder = screenshots_ids["model_b"]
 
         return {
             "model_a": f"https://drive.google.com/drive/folders/{model_a_folder}",
@@ -88,48 +424,96 @@ class GoogleDriveService:
             "created": created
         }
 
-    def create_task_screenshots(self, task_id: str, images: list[UploadScreenshot]):
-        created_images = []
+    def create_task_screenshots(self, task_id: str, images: list[UploadScreenshot], save_local: bool = False):
+        uploads = []
         for image in images:
             if image.model == "ideal":
-                filename = f"screenshots/{task_id}/{image.turn}_ideal_response.png"
+                model = "ideal"
+                file_name = f"{image.turn}_ideal_response.png"
+                file_path = f"screenshots/{task_id}/{file_name}"
             else:
                 suffix = f"_{image.suffix}" if image.suffix else ""
-                filename = f"screenshots/{task_id}/model_{image.model}/{image.turn}{suffix}.png"
-            with open(filename, "wb") as f:
-                b64 = image.image.split(",")[1]
-                f.write(base64.b64decode(b64))
-            created_images.append(filename)
-        return self.upload_task_screenshots(task_id, created_images)
+                model = f"model_{image.model}"
+                file_name = f"{image.turn}{suffix}.png"
+                file_path = f"screenshots/{task_id}/{model}/{file_name}"
+            uploads.append((model, file_name, file_path if save_local else None, image.image))
+        return self._upload_screenshots(task_id, uploads)
 
-    def upload_task_screenshots(self, task_id: str, created_images: list[str] = None):
+    def _upload_screenshot(
+        self, model: str, file_name: str, file_path: str | None, image: str | None, folder_id: str
+    ) -> dict:
+        if not folder_id:
+            # Without a parent the file would be uploaded to the root of the service account
+            return {"model": model, "file": file_name, "error": "Error: The folder of the task was not found"}
+        try:
+            if image is not None:
+                # Decoded here, so only the images being uploaded are held in memory
+                content = base64.b64decode(image.split(",")[1])
+                if file_path:
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    with open(file_path, "wb") as f:
+                        f.write(content)
+            else:
+                content = None
+            file_id = self._create_file(file_name, file_path, folder_id, content=content)
+            return {"model": model, "file": file_name, "id": file_id}
+        except HttpError as e:
+            # A 404 means the cached folder ID is stale and the upload can be retried after resolving it again
+            return {"model": model, "file": file_name, "error": f"Error: {e}", "not_found": e.resp.status == 404}
+        except Exception as e:
+            return {"model": model, "file": file_name, "error": f"Error: {e}"}
+
+    def _get_screenshot_folders(self, task_id: str) -> dict[str, str]:
         task_folder_id = self._search_folder(task_id, self.parent_folder_id)
         screenshots_folder_id = self._search_folder("screenshots", task_folder_id)
-        count = {"model_a": 0, "model_b": 0, "ideal": 0}
+        return {
+            "model_a": self._search_folder("model_a", screenshots_folder_id),
+            "model_b": self._search_folder("model_b", screenshots_folder_id),
+            "ideal": screenshots_folder_id,
+        }
 
-        model_a_folder_id = self._search_folder("model_a", screenshots_folder_id)
-        if created_images is not None:
-            images = [image.split("/")[-1] for image in created_images if "model_a" in image]
-        else:
-            images = os.listdir(f"screenshots/{task_id}/model_a")
-        for file in images:
-            self._create_file(file, f"screenshots/{task_id}/model_a/{file}", model_a_folder_id)
-            count["model_a"] += 1
-
-        model_b_folder_id = self._search_folder("model_b", screenshots_folder_id)
-        if created_images is not None:
-            images = [image.split("/")[-1] for image in created_images if "model_b" in image]
-        else:
-            images = os.listdir(f"screenshots/{task_id}/model_b")
-        for file in images:
-            self._create_file(file, f"screenshots/{task_id}/model_b/{file}", model_b_folder_id)
-            count["model_b"] += 1
+    def upload_task_screenshots(self, task_id: str, created_images: list[str] = None):
+        uploads = []
+        for model, directory in [
+            ("model_a", f"screenshots/{task_id}/model_a"),
+            ("model_b", f"screenshots/{task_id}/model_b"),
+            ("ideal", f"screenshots/{task_id}"),
+        ]:
+            if created_images is not None:
+                images = [image.split("/")[-1] for image in created_images if model in image]
+            else:
+                images = [file for file in os.listdir(directory) if os.path.isfile(f"{directory}/{file}")]
+            uploads.extend((model, file, f"{directory}/{file}", None) for file in images)
+        return self._upload_screenshots(task_id, uploads)
 
-        if created_images is not None:
-            images = [image.split("/")[-1] for image in created_images if "ideal" in image]
-        else:
-            images = os.listdir(f"screenshots/{task_id}")
-        for file in images:
-            self._create_file(file, f"screenshots/{task_id}/{file}", screenshots_folder_id)
-            count["ideal"] += 1
-        return count
+    def _upload_screenshots(self, task_id: str, uploads: list[tuple[str, str, str | None, str | None]]) -> dict:
+        """
+        Upload screenshots to the task folders, several at a time
+
+        :param task_id: The ID of the task
+        :param uploads: The (model, file name, local path, base64 image) of each screenshot. The image
+            is uploaded from memory if given, otherwise the local file is uploaded
+        :return: The amount of uploaded screenshots per model and the result of each file
+        """
+        folders = self._get_screenshot_folders(task_id)
+        with ThreadPoolExecutor(self.upload_workers, initializer=request_id.set, initargs=(request_id.get(),)) as executor:
+            files = list(executor.map(lambda upload: self._upload_screenshot(*upload, folders.get(upload[0])), uploads))
+
+            retries = [index for index, file in enumerate(files) if file.pop("not_found", False)]
+            if retries:
+                # The task folder may be the one that was deleted, so it is resolved again too
+                task_folder_id = self.folder_cache.get(self.parent_folder_id, task_id)
+                for folder_id in {task_folder_id, *folders.values()}:
+                    if folder_id:
+                        self.folder_cache.invalidate(folder_id)
+                folders = self._get_screenshot_folders(task_id)
+                retried = executor.map(lambda index: self._upload_screenshot(*uploads[index], folders.get(uploads[index][0])), retries)
+                for index, file in zip(retries, retried):
+                    file.pop("not_found", None)
+                    files[index] = file
+
+        count = {"model_a": 0, "model_b": 0, "ideal": 0}
+        for file in files:
+            if "error" not in file:
+                count[file["model"]] = count.get(file["model"], 0) + 1
+        return {**count, "files": files}
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from app.utils.json_file import read_json_file, write_json_file
+
+
+class ResumableUploads:
+    def __init__(self, path: str | None = None, ttl: float = 6 * 86400):
+        """
+        The session URIs of the resumable uploads in progress, persisted to a JSON file so an upload
+        interrupted by a restart continues where it stopped. Drive keeps a session for a week, so
+        older entries are dropped
+
+        :param path: The JSON file where the sessions are persisted. If None, they are only kept in memory
+        :param ttl: The seconds a session is reused
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions: dict[str, tuple[str, float]] = {
+            key: tuple(value) for key, value in read_json_file(path, {}).items()
+        }
+
+    def get(self, key: str) -> str | None:
+        """
+        Get the session URI of an upload
+
+        :param key: The key of the upload
+        :return: The session URI, or None if there is no session or it is too old
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session[1] < time.time():
+                return None
+            return session[0]
+
+    def set(self, key: str, resumable_uri: str) -> None:
+        with self._lock:
+            self._sessions[key] = (resumable_uri, time.time() + self.ttl)
+            self._save()
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            if self._sessions.pop(key, None) is not None:
+                self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        now = time.time()
+        self._sessions = {key: session for key, session in self._sessions.items() if session[1] >= now}
+        write_json_file(self.path, self._sessions)
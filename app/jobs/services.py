@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from app.logs import request_id
+
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job:
+    __slots__ = ("id", "name", "request_id", "status", "result", "error", "created_at", "started_at", "finished_at", "_finished")
+
+    def __init__(self, name: str):
+        """
+        A call running in the background
+
+        :param name: The name of the operation, e.g. the route that submitted it
+        """
+        self.id = uuid.uuid4().hex
+        self.name = name
+        # The request that submitted the job, so its logs can be tied to it
+        self.request_id = request_id.get()
+        self.status = JobStatus.PENDING
+        self.result: Any = None
+        self.error: str | None = None
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._finished = asyncio.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "name": self.name,
+            "request_id": self.request_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers: int = 4, max_pending: int = 100, ttl: float = 3600):
+        """
+        In-process queue of background jobs run by a fixed amount of workers. Finished jobs are
+        kept for the TTL so their result can be polled
+
+        :param workers: The amount of jobs running at the same time
+        :param max_pending: The max amount of jobs waiting for a worker
+        :param ttl: The seconds a finished job is kept
+        """
+        self.workers = workers
+        self.ttl = ttl
+        self._queue: asyncio.Queue[tuple[Job, Callable[[], Awaitable[Any]]]] = asyncio.Queue(max_pending)
+        self._jobs: dict[str, Job] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    def submit(self, name: str, func: Callable[[], Awaitable[Any]]) -> Job:
+        """
+        Queue a job. The workers are started on the first submit, since they need the running loop
+
+        :param name: The name of the operation
+        :param func: Returns the awaitable that runs the job
+        :return: The queued job
+        :raises asyncio.QueueFull: If there are too many pending jobs
+        """
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._expire()
+        job = Job(name)
+        self._queue.put_nowait((job, func))
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """
+        Wait until a job finishes or the timeout passes
+
+        :param job: The job
+        :param timeout: The max seconds to wait
+        :return: The job
+        """
+        try:
+            await asyncio.wait_for(asyncio.shield(job._finished.wait()), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    async def _work(self) -> None:
+        while True:
+            job, func = await self._queue.get()
+            job.status = JobStatus.RUNNING
+            request_id.set(job.request_id)
+            job.started_at = time.time()
+            try:
+                job.result = await func()
+                job.status = JobStatus.DONE
+            except Exception as e:
+                job.error = f"Error: {e}"
+                job.status = JobStatus.FAILED
+            job.finished_at = time.time()
+            job._finished.set()
+            self._queue.task_done()
+
+    def _expire(self) -> None:
+        limit = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < limit]:
+            del self._jobs[job_id]
+
+
+jobs = JobQueue(
+    workers=int(os.getenv("JOB_WORKERS", 4)),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", 100)),
+    ttl=float(os.getenv("JOB_TTL", 3600)),
+)
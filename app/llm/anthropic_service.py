@@ -1,8 +1,84 @@
 import json
+import logging
+import os
+import threading
+import time
+from collections.abc import AsyncIterator
+from types import MappingProxyType
+from typing import Any, Mapping
 
 import anthropic
+import httpx
 
 from app.constants import ClaudeModel
+from app.llm.cache import response_cache
+from app.llm.scheduler import Priority, scheduler
+from app.llm.streaming import CodeBlockParser, JsonFieldParser, TurnParser
+from app.metrics import record_tokens
+
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_PATH = os.path.join(os.path.dirname(__file__), "prompts.json")
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class _PromptsFile:
+    def __init__(self, path: str, check_interval: float = 1.0):
+        """
+        The prompts file, loaded on first use and shared as a read-only structure by every
+        _Prompts instance of the process. It is reloaded when its mtime changes, checking the
+        mtime at most once per interval.
+
+        Args:
+            path: The path of the prompts file.
+            check_interval: The seconds between mtime checks.
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._data: Mapping[str, Any] | None = None
+        self._mtime: int | None = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Mapping[str, Any]:
+        """
+        Gets the prompts, loading them if it is the first use or the file changed. If the file
+        can not be read (e.g. it is missing or half-written while it is saved), the last loaded
+        prompts are kept and it is read again on the next check.
+
+        Returns:
+            The read-only prompts.
+
+        Raises:
+            OSError, ValueError: If the file can not be read and it was never loaded.
+        """
+        now = time.monotonic()
+        if self._data is not None and now - self._checked_at < self.check_interval:
+            return self._data
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self._mtime:
+                    with open(self.path) as file:
+                        self._data = _freeze(json.load(file))
+                    self._mtime = mtime
+            except (OSError, ValueError):
+                if self._data is None:
+                    raise
+                logger.warning("Could not reload the prompts, keeping the last loaded ones", exc_info=True)
+        return self._data
+
+
+_prompts_file = _PromptsFile(PROMPTS_PATH, float(os.getenv("PROMPTS_RELOAD_INTERVAL", 1)))
 
 
 class _Prompts:
@@ -11,7 +87,17 @@ class _Prompts:
         PYTHON = "python"
 
     def __init__(self):
-        self.data = json.load(open("app/llm/prompts.json"))
+        self._data: Mapping[str, Any] | None = None
+        self._examples: dict[tuple[str, str], str] = {}
+
+    @property
+    def data(self) -> Mapping[str, Any]:
+        data = _prompts_file.get()
+        if data is not self._data:
+            # The file was (re)loaded, so the rendered examples are outdated
+            self._data = data
+            self._examples = {}
+        return data
 
     def build_prompt(
         self, prompt: str, model_a: str, model_b: str, code_output: str = None
@@ -35,6 +121,39 @@ class _Prompts:
             combined_prompt = f"{combined_prompt}\n\nCode output:\n{code_output}"
         return combined_prompt
 
+    def _render_examples(self, section: str, language: str) -> str:
+        """
+        Renders the examples of a prompts section as XML. The result is memoized per section and
+        language, since the examples are static and every request of a language sends the same
+        string (which also keeps the prompt cache prefix identical).
+
+        Args:
+            section: The key of the section in the prompts file.
+            language: The language of the examples, already resolved to one in the section.
+
+        Returns:
+            The rendered examples.
+        """
+        # Read first, since reading the data clears the memo when the file changed
+        data = self.data
+        key = (section, language)
+        rendered = self._examples.get(key)
+        if rendered is None:
+            parts = ["<examples>"]
+            for example in data[section][language]:
+                parts.append("<example>")
+                for name, value in example.items():
+                    tag = name.upper()
+                    value = str(value).replace("\\n", "\n").replace("\\'", "'")
+                    parts.append(f"<{tag}>{value}</{tag}>")
+                parts.append("</example>")
+            parts.append("</examples>")
+            rendered = self._examples[key] = "".join(parts)
+        return rendered
+
+    def _resolve_language(self, section: str, language: str, default: str) -> str:
+        return language if language in self.data[section] else default
+
     def generate_comparison_examples(self, language: Languages):
         """
         Generates the examples for the comparison prompt.
@@ -42,15 +161,8 @@ class _Prompts:
         Returns:
             The examples for the comparison prompt.
         """
-        examples = self.data["generate_comparison"].get(language, self.data["generate_comparison"][_Prompts.Languages.PYTHON])
-        response = "<examples>"
-        for example in examples:
-            response += "<example>"
-            for key, value in example.items():
-                response += f"<{key.upper()}>{str(value).replace('\\n', '\n').replace("\\'", "\'")}</{key.upper()}>"
-            response += "</example>"
-        response += "</examples>"
-        return response
+        language = self._resolve_language("generate_comparison", language, _Prompts.Languages.PYTHON)
+        return self._render_examples("generate_comparison", language)
 
     def generate_test_code_examples(self, language: Languages):
         """
@@ -59,15 +171,8 @@ class _Prompts:
         Returns:
             The examples for the test code prompt.
         """
-        examples = self.data["generate_test_code"].get(language, self.data["generate_test_code"][_Prompts.Languages.JAVASCRIPT])
-        response = "<examples>"
-        for example in examples:
-            response += "<example>"
-            for key, value in example.items():
-                response += f"<{key.upper()}>{value.replace('\\n', '\n').replace("\\'", "\'")}</{key.upper()}>"
-            response += "</example>"
-        response += "</examples>"
-        return response
+        language = self._resolve_language("generate_test_code", language, _Prompts.Languages.JAVASCRIPT)
+        return self._render_examples("generate_test_code", language)
 
     def generate_turns_examples(self, language: Languages):
         """
@@ -76,15 +181,7 @@ class _Prompts:
         Returns:
             The examples for the generate turns prompt.
         """
-        turns = self.data["generate_turns"][language]
-        response = "<examples>"
-        for example in turns:
-            response += "<example>"
-            for key, value in example.items():
-                response += f"<{key.upper()}>{value.replace('\\n', '\n').replace("\\'", "\'")}</{key.upper()}>"
-            response += "</example>"
-        response += "</examples>"
-        return response
+        return self._render_examples("generate_turns", language)
 
     def get_system_compare(self) -> str:
         return self.data["system"]["compare"]
@@ -95,12 +192,73 @@ class _Prompts:
     def get_system_generate_turns(self) -> str:
         return self.data["system"]["generate_turns"]
 
+def _cached_text(text: str) -> dict:
+    """
+    Builds a text content block marked as a prompt caching breakpoint. Everything up to and
+    including the block (tools, system and previous content) is cached, so it must only hold
+    static content that is byte identical across requests.
+
+    Args:
+        text: The static text.
+
+    Returns:
+        The cacheable text content block.
+    """
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
 class AnthropicService:
+    USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
     def __init__(self):
-        self.client = anthropic.Anthropic()
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+        # Retries are done by the scheduler, which knows the rate limits of every request
+        self.client = anthropic.AsyncAnthropic(
+            max_retries=0,
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
         self.prompts = _Prompts()  # TODO: Build json from the Anthropic generated code (XML)
+        self.usage: dict[str, dict[str, int]] = {}
+
+    def _record_usage(self, operation: str, message: anthropic.types.Message) -> None:
+        """
+        Adds the token usage of a response to the totals of the operation, including the tokens
+        written to and read from the prompt cache.
+
+        Args:
+            operation: The name of the service method.
+            message: The response of the API.
+        """
+        totals = self.usage.setdefault(operation, dict.fromkeys(("requests", *self.USAGE_FIELDS), 0))
+        totals["requests"] += 1
+        for field in self.USAGE_FIELDS:
+            totals[field] += getattr(message.usage, field, None) or 0
+        record_tokens(
+            "anthropic",
+            message.model,
+            input=message.usage.input_tokens,
+            output=message.usage.output_tokens,
+            cache_read=getattr(message.usage, "cache_read_input_tokens", None),
+            cache_write=getattr(message.usage, "cache_creation_input_tokens", None),
+        )
+        logger.info(
+            "usage",
+            extra={"data": {
+                "operation": operation,
+                "model": message.model,
+                **{field: getattr(message.usage, field, None) or 0 for field in self.USAGE_FIELDS},
+            }},
+        )
+
+    async def _create(self, request: dict, priority: int = Priority.INTERACTIVE) -> anthropic.types.Message:
+        return await scheduler.request("anthropic", self.client.messages.with_raw_response.create, request, priority)
 
-    def generate_turns(
+    def _stream(self, request: dict):
+        return scheduler.stream("anthropic", self.client.messages.stream, request)
+
+    async def generate_turns(
         self, prompt: str, model: ClaudeModel = ClaudeModel.SONET_3_5, language: _Prompts.Languages = _Prompts.Languages.PYTHON
     ) -> list[dict[str, str]]:
         """
@@ -114,51 +272,67 @@ class AnthropicService:
             The conversation turns.
         """
         # return [{"user": "I'm working on a shared repository where multiple teams access sensitive data through API endpoints. I need to create a function that validates user permissions and logs access attempts. Could you help me implement this with clear comments explaining the security implications?","assistant": "Implementation of a permission validation decorator with detailed security comments, logging mechanisms, and access control checks using environment variables.",},{"user": "For our CI/CD pipeline, I want to add a function that automatically checks for potential security vulnerabilities in merge requests, specifically focusing on hardcoded credentials and insecure data access patterns. How can I implement this with clear documentation?","assistant": "Implementation of a security check function using ast module to parse Python code and detect security issues, with comprehensive comments about each vulnerability pattern.",},{"user": "What are the best practices for documenting security-related code changes in a way that helps prevent merge conflicts while maintaining sensitive information confidentiality? Our team is growing and we need to establish clear guidelines.","assistant": "Detailed explanation of documentation best practices, including templates for security-related changes and strategies for handling sensitive information in comments.",},]
+        message = await self._create(self._turns_request(prompt, model, language))
+        self._record_usage("generate_turns", message)
+        text = message.content[0].text
+        logger.debug("generate_turns completion", extra={"data": {"text": text}})
+        parser = TurnParser()
+        parser.feed(text)
+        parser.close()
+        return parser.turns if parser.turns else text
+
+    def _turns_request(self, prompt: str, model: ClaudeModel, language: str) -> dict:
         prompt = f"{prompt}\nLanguage: {language}"
-        message = self.client.messages.create(
+        return dict(
             model=model,
             max_tokens=1000,
             temperature=0.3,
-            system=self.prompts.get_system_generate_turns(),
+            system=[_cached_text(self.prompts.get_system_generate_turns())],
             messages=[
                 {
                     "role": "user",
                     "content": [
-                        {
-                            "type": "text",
-                            "text": self.prompts.generate_turns_examples(language),
-                        },
+                        _cached_text(self.prompts.generate_turns_examples(language)),
                         {"type": "text", "text": prompt},
                     ],
                 }
             ],
         )
-        text = message.content[0].text
-        print(text)
-        lines = text.split("\n")
-        turns = []
-        for line in lines:
-            if line.startswith("U:"):
-                turns.append({"user": line[2:].strip().replace('"', "")})
-            elif line.startswith("A:"):
-                turns[-1]["assistant"] = line[2:].strip().replace('"', "")
-            elif turns:
-                if "assistant" in turns[-1]:
-                    turns[-1]["assistant"] += f"\n{line}"
-                else:
-                    turns[-1]["user"] += f"\n{line}"
-        for turn in turns:
-            turn["user"] = turn["user"].strip()
-        return turns if turns else text
-
-    def compare_responses(
+
+    async def stream_generate_turns(
+        self, prompt: str, model: ClaudeModel = ClaudeModel.SONET_3_5, language: _Prompts.Languages = _Prompts.Languages.PYTHON
+    ) -> AsyncIterator[dict]:
+        """
+        Generates the initial conversation turns, sending the user and assistant part of each turn
+        as soon as it is complete.
+
+        Args:
+            prompt: The user prompt.
+            model: The model to use.
+
+        Returns:
+            The "turn" events and the final "done" event, with the same result as generate_turns.
+        """
+        parser = TurnParser()
+        async with self._stream(self._turns_request(prompt, model, language)) as stream:
+            async for text in stream.text_stream:
+                for part in parser.feed(text):
+                    yield {"event": "turn", "data": part}
+            message = await stream.get_final_message()
+        for part in parser.close():
+            yield {"event": "turn", "data": part}
+        self._record_usage("generate_turns", message)
+        yield {"event": "done", "data": parser.turns if parser.turns else message.content[0].text}
+
+    async def compare_responses(
         self,
         prompt: str,
         model_a: str,
         model_b: str,
         output: str = None,
         model: ClaudeModel = ClaudeModel.SONET_3_5,
-        language: _Prompts.Languages = _Prompts.Languages.PYTHON
+        language: _Prompts.Languages = _Prompts.Languages.PYTHON,
+        priority: int = Priority.INTERACTIVE,
     ) -> dict:
         """
         Compares the responses of two models and returns the comparison result.
@@ -169,24 +343,31 @@ class AnthropicService:
             model_b: The response of the second model.
             output: The output of the code.
             model: The model to use.
+            priority: The priority of the request in the scheduler.
 
         Returns:
             The comparison result.
         """
         # return {'model_a': {'instruction_following': {'score': 'No issues', 'comment': 'The response directly addresses the request to create a function simulating salt precipitation in a sabkha environment, incorporating relevant environmental parameters like temperature, salinity, and evaporation rates.'}, 'truthfulness': {'score': 'No issues', 'comment': 'The implementation matches the explanation provided, with the code accurately modeling salt precipitation based on the described parameters and processes. The output shows gradual salt accumulation over time as expected in a sabkha environment.'}, 'conciseness': {'score': 'Just right', 'comment': 'The response provides necessary detail about the implementation while maintaining clarity, including relevant parameters, considerations, and example usage without unnecessary verbosity.'}, 'content_safety': {'score': 'No issues', 'comment': 'The content focuses purely on geological modeling and scientific calculations, with no concerning elements.'}, 'overall_satisfaction': {'score': 'Pretty good', 'comment': 'The solution offers a practical implementation for modeling salt precipitation, with clear documentation and consideration of key environmental factors.'}}, 'model_b': {'instruction_following': {'score': 'No issues', 'comment': 'The model implements a function that simulates salt precipitation in a sabkha environment, incorporating the requested environmental parameters and producing relevant outputs.'}, 'truthfulness': {'score': 'No issues', 'comment': 'The code implementation aligns with the explanation, showing accurate modeling of salt precipitation based on physical parameters. The output demonstrates expected behavior in salinity changes and precipitation patterns.'}, 'conciseness': {'score': 'Just right', 'comment': 'The response provides a well-structured explanation with appropriate detail level, including key parameters and considerations without excessive information.'}, 'content_safety': {'score': 'No issues', 'comment': 'The content remains focused on scientific modeling and geological processes without any concerning elements.'}, 'overall_satisfaction': {'score': 'Pretty good', 'comment': 'The solution provides a comprehensive approach to modeling salt precipitation, with clear implementation and consideration of relevant physical parameters.'}}, 'comparison': {'score': 'Model A is slightly better than Model B', 'comment': "While both models provide solid implementations, Model A edges ahead with its more detailed precipitation process and clearer accumulation pattern in the output. Model A's implementation shows a more realistic gradual increase in salt precipitation over time, whereas Model B's output shows less variation in precipitation values. Both models handle the core requirements well, but Model A's more nuanced approach to the precipitation process makes it marginally more suitable for paleoenvironment reconstruction."}}
-        message = self.client.messages.create(
+        message = await self._create(
+            self._compare_request(prompt, model_a, model_b, output, model, language), priority
+        )
+        self._record_usage("compare_responses", message)
+        return self._parse_comparison(message.content[0].text)
+
+    def _compare_request(
+        self, prompt: str, model_a: str, model_b: str, output: str | None, model: ClaudeModel, language: str
+    ) -> dict:
+        return dict(
             model=model,
             max_tokens=1520,
             temperature=0.3,
-            system=self.prompts.get_system_compare(),
+            system=[_cached_text(self.prompts.get_system_compare())],
             messages=[
                 {
                     "role": "user",
                     "content": [
-                        {
-                            "type": "text",
-                            "text": self.prompts.generate_comparison_examples(language),
-                        },
+                        _cached_text(self.prompts.generate_comparison_examples(language)),
                         {
                             "type": "text",
                             "text": self.prompts.build_prompt(
@@ -197,32 +378,77 @@ class AnthropicService:
                 }
             ],
         )
+
+    @staticmethod
+    def _parse_comparison(text: str) -> dict | str:
         try:
-            return json.loads(message.content[0].text)
+            return json.loads(text)
         except json.decoder.JSONDecodeError:
-            return message.content[0].text
+            return text
 
-    def generate_test_code(
+    async def stream_compare_responses(
+        self,
+        prompt: str,
+        model_a: str,
+        model_b: str,
+        output: str = None,
+        model: ClaudeModel = ClaudeModel.SONET_3_5,
+        language: _Prompts.Languages = _Prompts.Languages.PYTHON
+    ) -> AsyncIterator[dict]:
+        """
+        Compares the responses of two models, streaming the tokens as they arrive. Each field of the
+        comparison (e.g. the score of a model in a category) is sent as soon as it is complete.
+
+        Args:
+            prompt: The user prompt.
+            model_a: The response of the first model.
+            model_b: The response of the second model.
+            output: The output of the code.
+            model: The model to use.
+
+        Returns:
+            The "token", "field" and final "done" events, with the same result as compare_responses.
+        """
+        parser = JsonFieldParser()
+        async with self._stream(self._compare_request(prompt, model_a, model_b, output, model, language)) as stream:
+            async for text in stream.text_stream:
+                yield {"event": "token", "data": text}
+                for path, value in parser.feed(text):
+                    yield {"event": "field", "data": {"path": path, "value": value}}
+            message = await stream.get_final_message()
+        self._record_usage("compare_responses", message)
+        yield {"event": "done", "data": self._parse_comparison(message.content[0].text)}
+
+    async def generate_test_code(
         self,
         question: str,
         response: str,
         model: ClaudeModel = ClaudeModel.SONET_3_5,
-        language: _Prompts.Languages = _Prompts.Languages.PYTHON
+        language: _Prompts.Languages = _Prompts.Languages.PYTHON,
+        priority: int = Priority.INTERACTIVE,
     ) -> dict:
         # return "Here's a minimal test code to verify the functionality of the TokenManager implementation:\n\n```javascript\nimport jwt from 'jsonwebtoken';\n\n// First, import all the classes from the response\n// (Assuming they're in the same file or properly exported)\n\n// Test function\nasync function runTests() {\n    console.log('Starting TokenManager Tests\\n');\n    \n    const secretKey = 'test-secret-key';\n    const tokenManager = new TokenManager(secretKey);\n    \n    // Test 1: Token Generation and Validation\n    console.log('Test 1: Token Generation and Validation');\n    try {\n        const payload = {\n            userId: 123,\n            ipAddress: '127.0.0.1'\n        };\n        \n        const token = tokenManager.generateToken(payload);\n        console.log('Generated Token:', token);\n        \n        const validatedPayload = tokenManager.validateToken(token, payload.ipAddress);\n        console.log('Validated Payload:', validatedPayload);\n        console.log('Test 1: ✅ Success\\n');\n    } catch (error) {\n        console.log('Test 1: ❌ Failed -', error.message, '\\n');\n    }\n    \n    // Test 2: Rate Limiting\n    console.log('Test 2: Rate Limiting');\n    try {\n        const payload = {\n            userId: 456,\n            ipAddress: '127.0.0.2'\n        };\n        \n        // Generate first token (should succeed)\n        const token1 = tokenManager.generateToken(payload);\n        console.log('First token generated successfully');\n        \n        // Try to generate second token (should fail due to rate limit)\n        try {\n            const token2 = tokenManager.generateToken(payload);\n            console.log('Test 2: ❌ Failed - Rate limit not working\\n');\n        } catch (error) {\n            console.log('Expected rate limit error:', error.message);\n            console.log('Test 2: ✅ Success\\n');\n        }\n    } catch (error) {\n        console.log('Test 2: ❌ Failed -', error.message, '\\n');\n    }\n    \n    // Test 3: Token Blacklisting\n    console.log('Test 3: Token Blacklisting');\n    try {\n        const payload = {\n            userId: 789,\n            ipAddress: '127.0.0.3'\n        };\n        \n        const token = tokenManager.generateToken(payload);\n        console.log('Generated token for blacklist test');\n        \n        // Blacklist the token\n        tokenManager.blacklistToken(token);\n        console.log('Token blacklisted');\n        \n        // Try to validate blacklisted token\n        try {\n            tokenManager.validateToken(token, payload.ipAddress);\n            console.log('Test 3: ❌ Failed - Blacklist not working\\n');\n        } catch (error) {\n            console.log('Expected blacklist error:', error.message);\n            console.log('Test 3: ✅ Success\\n');\n        }\n    } catch (error) {\n        console.log('Test 3: ❌ Failed -', error.message, '\\n');\n    }\n}\n\n// Run the tests\nrunTests().catch(console.error);\n```\n\nTo run this test, you'll need to:\n\n1. Install the required dependency:\n```bash\nnpm install jsonwebtoken\n```\n\n2. Save both the implementation and test code in files with `.js` extension\n\n3. Run the test using Node.js with ES modules enabled:\n```bash\nnode --experimental-modules test.js\n```\n\nThis test code verifies three main functionalities:\n1. Token generation and validation\n2. Rate limiting functionality\n3. Token blacklisting\n\nThe tests are designed to be minimal while still covering the core functionality of the TokenManager facade pattern implementation. Each test provides clear output indicating success or failure, making it easy to verify that the implementation is working as expected."
-        message = self.client.messages.create(
+        request = self._test_code_request(question, response, model, language)
+        # Deterministic (temperature 0), so identical requests are answered from the cache
+        text = await response_cache.get(request)
+        if text is None:
+            message = await self._create(request, priority)
+            self._record_usage("generate_test_code", message)
+            text = message.content[0].text
+            await response_cache.set(request, text)
+        return text
+
+    def _test_code_request(self, question: str, response: str, model: ClaudeModel, language: str) -> dict:
+        return dict(
             model=model,
             max_tokens=4096,
             temperature=0,
-            system=self.prompts.get_system_generate_test_code(),
+            system=[_cached_text(self.prompts.get_system_generate_test_code())],
             messages=[
                 {
                     "role": "user",
                     "content": [
-                        {
-                            "type": "text",
-                            "text": self.prompts.generate_test_code_examples(language),
-                        },
+                        _cached_text(self.prompts.generate_test_code_examples(language)),
                         {
                             "type": "text",
                             "text": f"<question>{question}</question><response>{response}</response>"
@@ -231,9 +457,37 @@ class AnthropicService:
                 }
             ],
         )
-        return message.content[0].text
 
-    def reevaluate_responses(
+    async def stream_generate_test_code(
+        self,
+        question: str,
+        response: str,
+        model: ClaudeModel = ClaudeModel.SONET_3_5,
+        language: _Prompts.Languages = _Prompts.Languages.PYTHON
+    ) -> AsyncIterator[dict]:
+        """
+        Generates the test code, streaming the tokens as they arrive. Each fenced code block is sent
+        as soon as it is closed.
+
+        Args:
+            question: The user prompt.
+            response: The response to be tested.
+            model: The model to use.
+
+        Returns:
+            The "token", "code" and final "done" events, with the same result as generate_test_code.
+        """
+        parser = CodeBlockParser()
+        async with self._stream(self._test_code_request(question, response, model, language)) as stream:
+            async for text in stream.text_stream:
+                yield {"event": "token", "data": text}
+                for block in parser.feed(text):
+                    yield {"event": "code", "data": block}
+            message = await stream.get_final_message()
+        self._record_usage("generate_test_code", message)
+        yield {"event": "done", "data": message.content[0].text}
+
+    async def reevaluate_responses(
         self,
         prompt: str,
         model_a: str,
@@ -261,10 +515,7 @@ class AnthropicService:
             {
                 "role": "user",
                 "content": [
-                    {
-                        "type": "text",
-                        "text": self.prompts.generate_comparison_examples(language),
-                    },
+                    _cached_text(self.prompts.generate_comparison_examples(language)),
                     {
                         "type": "text",
                         "text": self.prompts.build_prompt(
@@ -287,12 +538,13 @@ class AnthropicService:
                 ],
             },
         ]
-        message = self.client.messages.create(
+        message = await self._create(dict(
             model="claude-3-5-sonnet-20241022",
             max_tokens=1520,
             temperature=0.3,
             messages=messages,
-        )
+        ))
+        self._record_usage("reevaluate_responses", message)
         text = message.content[0].text
         try:
             return json.loads(text[text.index("{") : text.rindex("}") + 1])
@@ -0,0 +1,379 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from collections.abc import AsyncIterator, Iterable
+
+from pydantic import ValidationError
+
+from app.constants import ClaudeModel
+from app.jobs.services import JobStatus
+from app.llm.anthropic_service import AnthropicService
+from app.models import CompareResponsesRequest
+from app.utils.json_file import read_json_file, write_json_file
+
+
+logger = logging.getLogger(__name__)
+
+
+class AnthropicBatchProvider:
+    BETAS = ["message-batches-2024-09-24"]
+
+    def __init__(self, service: AnthropicService):
+        """
+        Runs the requests through the Message Batches API, which processes them asynchronously
+        at half the price and outside of the rate limits of the Messages API.
+
+        Args:
+            service: The service whose client and usage totals are used.
+        """
+        self.service = service
+        # The batch endpoints are not scheduled, so they keep the retries of the SDK
+        self.batches = service.client.with_options(max_retries=2).beta.messages.batches
+
+    async def submit(self, requests: list[dict]) -> str:
+        """
+        Creates a batch.
+
+        Args:
+            requests: The batch requests, each with a custom_id and the params of the message.
+
+        Returns:
+            The ID of the batch.
+        """
+        batch = await self.batches.create(requests=requests, betas=self.BETAS)
+        return batch.id
+
+    async def is_done(self, batch_id: str) -> bool:
+        batch = await self.batches.retrieve(batch_id, betas=self.BETAS)
+        return batch.processing_status == "ended"
+
+    async def results(self, batch_id: str) -> AsyncIterator[tuple[str, str | None, str | None]]:
+        """
+        Gets the results of an ended batch, in any order.
+
+        Args:
+            batch_id: The ID of the batch.
+
+        Returns:
+            The custom ID, text and error of each request. Either the text or the error is None.
+        """
+        async for item in await self.batches.results(batch_id, betas=self.BETAS):
+            if item.result.type == "succeeded":
+                self.service._record_usage("compare_responses_batch", item.result.message)
+                yield item.custom_id, item.result.message.content[0].text, None
+            elif item.result.type == "errored":
+                yield item.custom_id, None, f"Error: {item.result.error.error.message}"
+            else:
+                yield item.custom_id, None, f"Error: {item.result.type}"
+
+
+class MockBatchProvider:
+    def __init__(self, delay: float = 1.0):
+        """
+        Answers every request with a fixed comparison after the delay, to run bulk comparisons
+        locally without calling the API.
+
+        Args:
+            delay: The seconds a batch takes to end.
+        """
+        self.delay = delay
+        self._batches: dict[str, tuple[float, list[str]]] = {}
+
+    async def submit(self, requests: list[dict]) -> str:
+        batch_id = f"mock_{uuid.uuid4().hex}"
+        self._batches[batch_id] = (time.monotonic() + self.delay, [request["custom_id"] for request in requests])
+        return batch_id
+
+    async def is_done(self, batch_id: str) -> bool:
+        if batch_id not in self._batches:
+            raise LookupError(f"Unknown mock batch {batch_id}, mock batches are lost on restart")
+        return time.monotonic() >= self._batches[batch_id][0]
+
+    async def results(self, batch_id: str) -> AsyncIterator[tuple[str, str | None, str | None]]:
+        for custom_id in self._batches.pop(batch_id)[1]:
+            text = json.dumps({
+                "model_a": {"overall_satisfaction": {"score": "Pretty good", "comment": "Mock comparison"}},
+                "model_b": {"overall_satisfaction": {"score": "Pretty good", "comment": "Mock comparison"}},
+                "comparison": {"score": "Model A and Model B are equally good", "comment": "Mock comparison"},
+            })
+            yield custom_id, text, None
+
+
+class BulkComparison:
+    def __init__(self, provider_name: str, results_dir: str, bulk_id: str | None = None):
+        """
+        A set of comparisons run through a batch provider, whose results are written as JSONL. Its
+        state is saved next to the results, so it can be resumed after a restart.
+
+        Args:
+            provider_name: The name of the provider.
+            results_dir: The folder of the results and state files.
+            bulk_id: The ID of a saved bulk comparison. Defaults to a new one.
+        """
+        self.id = bulk_id or uuid.uuid4().hex
+        self.provider_name = provider_name
+        self.output_path = os.path.join(results_dir, f"{self.id}.jsonl")
+        self.state_path = os.path.join(results_dir, f"{self.id}.json")
+        self.status = JobStatus.PENDING
+        self.error: str | None = None
+        self.batch_ids: list[str] = []
+        self.total = 0
+        self.succeeded = 0
+        self.errored = 0
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        # Custom IDs of the batch requests mapped to the input IDs
+        self.ids: dict[str, str] = {}
+        # The batches whose results are written, and the size of the results file after them
+        self.collected: list[str] = []
+        self.output_size = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "bulk_id": self.id,
+            "provider": self.provider_name,
+            "status": self.status,
+            "error": self.error,
+            "batch_ids": self.batch_ids,
+            "total": self.total,
+            "succeeded": self.succeeded,
+            "errored": self.errored,
+            "pending": self.total - self.succeeded - self.errored,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def to_state(self) -> dict:
+        return {**self.to_dict(), "ids": self.ids, "collected": self.collected, "output_size": self.output_size}
+
+    @classmethod
+    def from_state(cls, state: dict, results_dir: str) -> "BulkComparison":
+        """
+        Restores a bulk comparison saved with to_state.
+
+        Args:
+            state: The saved state.
+            results_dir: The folder of the results and state files.
+
+        Returns:
+            The bulk comparison.
+        """
+        run = cls(state["provider"], results_dir, state["bulk_id"])
+        for field in ("status", "error", "batch_ids", "total", "succeeded", "errored", "created_at", "finished_at",
+                      "ids", "collected", "output_size"):
+            setattr(run, field, state[field])
+        return run
+
+
+def parse_comparison_inputs(lines: Iterable[bytes | str]) -> Iterable[tuple[str, CompareResponsesRequest | None, str | None]]:
+    """
+    Parses a JSONL of comparison inputs. Each line has the fields of /llm/comparison/compare and
+    an optional "id", which defaults to the line number.
+
+    Args:
+        lines: The lines of the file.
+
+    Returns:
+        The ID, parsed input and error of each non-empty line. Either the input or the error is None.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            item_id = str(item.pop("id", number))
+        except (json.JSONDecodeError, AttributeError) as e:
+            yield str(number), None, f"Error: Invalid JSON line: {e}"
+            continue
+        try:
+            yield item_id, CompareResponsesRequest(**item), None
+        except ValidationError as e:
+            yield item_id, None, f"Error: {e}"
+
+
+class BulkComparisons:
+    def __init__(
+        self, service: AnthropicService, results_dir: str, max_requests: int, max_bytes: int, poll_interval: float
+    ):
+        """
+        Runs bulk comparisons in the background. Every batch is submitted right away, so the
+        throughput depends on the batch capacity of the provider instead of a request loop.
+
+        Args:
+            service: The service used to build the requests.
+            results_dir: The folder of the results files.
+            max_requests: The max amount of requests per batch.
+            max_bytes: The max size of the serialized requests of a batch.
+            poll_interval: The seconds between batch status checks.
+        """
+        self.service = service
+        self.results_dir = results_dir
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.providers = {
+            "anthropic": AnthropicBatchProvider(service),
+            "mock": MockBatchProvider(float(os.getenv("LLM_BATCH_MOCK_DELAY", 1))),
+        }
+        self._runs: dict[str, BulkComparison] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def start(self, provider_name: str, lines: Iterable[bytes | str], model: ClaudeModel = ClaudeModel.SONET_3_5) -> BulkComparison:
+        """
+        Starts a bulk comparison.
+
+        Args:
+            provider_name: The name of the provider, "anthropic" or "mock".
+            lines: The lines of the JSONL file with the comparison inputs.
+            model: The model to use.
+
+        Returns:
+            The bulk comparison, whose progress can be polled with its ID.
+
+        Raises:
+            KeyError: If the provider does not exist.
+        """
+        provider = self.providers[provider_name]
+        os.makedirs(self.results_dir, exist_ok=True)
+        run = BulkComparison(provider_name, self.results_dir)
+        inputs = list(parse_comparison_inputs(lines))
+        run.total = len(inputs)
+        self._runs[run.id] = run
+        self._save(run)
+        self._tasks[run.id] = asyncio.create_task(self._run(run, provider, inputs, model))
+        return run
+
+    def get(self, bulk_id: str) -> BulkComparison | None:
+        return self._runs.get(bulk_id)
+
+    def resume(self) -> None:
+        """
+        Loads the bulk comparisons saved in the results folder and collects the batches of the
+        unfinished ones, which outlive restarts of the server. Must be called with a running event
+        loop, e.g. at startup.
+        """
+        for state_path in glob.glob(os.path.join(self.results_dir, "*.json")):
+            state = read_json_file(state_path)
+            if not state or state.get("bulk_id") in self._runs:
+                continue
+            try:
+                run = BulkComparison.from_state(state, self.results_dir)
+            except (KeyError, TypeError):
+                logger.warning("invalid bulk comparison state", extra={"data": {"path": state_path}})
+                continue
+            self._runs[run.id] = run
+            if run.status in (JobStatus.DONE, JobStatus.FAILED):
+                continue
+            provider = self.providers.get(run.provider_name)
+            if provider is None or len(run.batch_ids) == 0:
+                # The inputs are only kept until the batches are submitted
+                run.error = "Error: The server restarted before the batches were submitted"
+                run.status = JobStatus.FAILED
+                run.finished_at = time.time()
+                self._save(run)
+                continue
+            logger.info("resuming bulk comparison", extra={"data": {"bulk_id": run.id, "batch_ids": run.batch_ids}})
+            self._tasks[run.id] = asyncio.create_task(self._run(run, provider))
+
+    async def _run(self, run: BulkComparison, provider, inputs: list | None = None, model: ClaudeModel = None) -> None:
+        """
+        Submits the inputs and collects the results of the batches. Without inputs, collects the
+        batches of a resumed run whose results are not written yet.
+        """
+        run.status = JobStatus.RUNNING
+        self._save(run)
+        try:
+            if inputs is None:
+                # Drops the lines of the batches that were being written when the server stopped
+                output = open(run.output_path, "r+")
+                output.truncate(run.output_size)
+                output.seek(run.output_size)
+            else:
+                output = open(run.output_path, "w")
+            with output:
+                if inputs is not None:
+                    await self._submit(run, provider, inputs, model, output)
+                # If a batch fails, the task group cancels the others before the file is closed
+                async with asyncio.TaskGroup() as group:
+                    for batch_id in run.batch_ids:
+                        if batch_id not in run.collected:
+                            group.create_task(self._collect(run, provider, batch_id, output))
+            run.status = JobStatus.DONE
+        except Exception as e:
+            if isinstance(e, ExceptionGroup):
+                e = e.exceptions[0]
+            run.error = f"Error: {e}"
+            run.status = JobStatus.FAILED
+        run.finished_at = time.time()
+        self._save(run)
+        del self._tasks[run.id]
+
+    async def _submit(self, run: BulkComparison, provider, inputs: list, model: ClaudeModel, output) -> None:
+        requests = []
+        for item_id, body, error in inputs:
+            if error:
+                self._write(run, output, item_id, None, error)
+                continue
+            # Custom IDs only allow [a-zA-Z0-9_-], so the input IDs are mapped back from the position
+            custom_id = f"item-{len(requests)}"
+            run.ids[custom_id] = item_id
+            params = self.service._compare_request(
+                body.prompt, body.model_a, body.model_b, body.output, model, body.language
+            )
+            requests.append({"custom_id": custom_id, "params": params})
+        run.output_size = output.tell()
+        run.batch_ids = list(await asyncio.gather(*(provider.submit(chunk) for chunk in self._chunks(requests))))
+        self._save(run)
+
+    def _chunks(self, requests: list[dict]) -> list[list[dict]]:
+        """
+        Splits the requests into batches by their amount and by their serialized size, since the
+        few-shot examples make each request large enough to reach the size limit of a batch first.
+
+        Args:
+            requests: The batch requests.
+
+        Returns:
+            The requests of each batch.
+        """
+        chunks, size = [], 0
+        for request in requests:
+            request_size = len(json.dumps(request, default=str).encode())
+            if not chunks or len(chunks[-1]) >= self.max_requests or size + request_size > self.max_bytes:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(request)
+            size += request_size
+        return chunks
+
+    async def _collect(self, run: BulkComparison, provider, batch_id: str, output) -> None:
+        while not await provider.is_done(batch_id):
+            await asyncio.sleep(self.poll_interval)
+        results = []
+        async for custom_id, text, error in provider.results(batch_id):
+            result = None if text is None else self.service._parse_comparison(text)
+            results.append((run.ids[custom_id], result, error))
+        # Written without awaiting, so the lines of each batch are contiguous and the saved size
+        # only covers whole batches
+        for item_id, result, error in results:
+            self._write(run, output, item_id, result, error)
+        run.collected.append(batch_id)
+        run.output_size = output.tell()
+        self._save(run)
+
+    @staticmethod
+    def _save(run: BulkComparison) -> None:
+        write_json_file(run.state_path, run.to_state())
+
+    @staticmethod
+    def _write(run: BulkComparison, output, item_id: str, result, error: str | None) -> None:
+        output.write(json.dumps({"id": item_id, "result": result, "error": error}) + "\n")
+        output.flush()
+        if error:
+            run.errored += 1
+        else:
+            run.succeeded += 1
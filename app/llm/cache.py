@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+
+logger = logging.getLogger(__name__)
+
+
+class _SQLiteBackend:
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_response_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS llm_response_cache_created_at ON llm_response_cache (created_at)"
+            )
+
+    def get(self, key: str, now: float) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM llm_response_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, now: float, expires_at: float) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, expires_at),
+            )
+
+    def evict(self, now: float, max_entries: int) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,))
+            self._connection.execute(
+                "DELETE FROM llm_response_cache WHERE key IN "
+                "(SELECT key FROM llm_response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,),
+            )
+
+
+class _PostgresBackend:
+    def __init__(self, url: str):
+        import psycopg
+
+        self._psycopg = psycopg
+        self._url = url
+        self._connection = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._execute(
+                "CREATE TABLE IF NOT EXISTS llm_response_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at DOUBLE PRECISION NOT NULL, "
+                "expires_at DOUBLE PRECISION NOT NULL)"
+            )
+            self._execute("CREATE INDEX IF NOT EXISTS llm_response_cache_created_at ON llm_response_cache (created_at)")
+
+    def _execute(self, query: str, params: tuple = ()):
+        # Called with the lock held. After an error the connection is closed and opened again by
+        # the next call, so the cache recovers from a restart of Postgres
+        if self._connection is None or self._connection.closed:
+            self._connection = self._psycopg.connect(self._url, autocommit=True, connect_timeout=5)
+        try:
+            return self._connection.execute(query, params)
+        except Exception:
+            self._connection.close()
+            raise
+
+    def get(self, key: str, now: float) -> str | None:
+        with self._lock:
+            row = self._execute(
+                "SELECT value FROM llm_response_cache WHERE key = %s AND expires_at > %s", (key, now)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, now: float, expires_at: float) -> None:
+        with self._lock:
+            self._execute(
+                "INSERT INTO llm_response_cache (key, value, created_at, expires_at) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, created_at = EXCLUDED.created_at, "
+                "expires_at = EXCLUDED.expires_at",
+                (key, value, now, expires_at),
+            )
+
+    def evict(self, now: float, max_entries: int) -> None:
+        with self._lock:
+            self._execute("DELETE FROM llm_response_cache WHERE expires_at <= %s", (now,))
+            self._execute(
+                "DELETE FROM llm_response_cache WHERE key IN "
+                "(SELECT key FROM llm_response_cache ORDER BY created_at DESC OFFSET %s)",
+                (max_entries,),
+            )
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        url: str | None,
+        ttl: float = 86400,
+        max_entries: int = 10000,
+        evict_every: int = 100,
+        retry_interval: float = 30,
+    ):
+        """
+        Cache of LLM responses keyed by the hash of the full request (model, parameters and
+        messages), stored in Postgres or SQLite. Entries expire after the TTL and the oldest ones
+        are evicted once there are more than max_entries. If the database fails, the requests are
+        sent to the provider uncached and the cache is skipped for retry_interval seconds.
+
+        Args:
+            url: "postgresql://..." for Postgres or "sqlite:///path" for SQLite. If empty, nothing is cached.
+            ttl: The seconds a response is valid.
+            max_entries: The max amount of cached responses.
+            evict_every: The amount of writes between evictions.
+            retry_interval: The seconds the cache is skipped after a database error.
+        """
+        self.url = url
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.retry_interval = retry_interval
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._backend: _SQLiteBackend | _PostgresBackend | None = None
+        self._backend_lock = threading.Lock()
+        self._retry_at = 0.0
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        """
+        Builds the key of a request.
+
+        Args:
+            request: The keyword arguments of the API call.
+
+        Returns:
+            The SHA-256 of the canonical JSON of the request.
+        """
+        payload = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _get_backend(self) -> _SQLiteBackend | _PostgresBackend:
+        # Connected on first use, so importing the service does not need the database
+        with self._backend_lock:
+            if self._backend is None:
+                if self.url.startswith(("postgres://", "postgresql://")):
+                    self._backend = _PostgresBackend(self.url)
+                else:
+                    self._backend = _SQLiteBackend(self.url.removeprefix("sqlite:///"))
+            return self._backend
+
+    def _call(self, method: str, *args) -> Any:
+        # Runs in a worker thread, since connecting and querying block
+        if time.monotonic() < self._retry_at:
+            return None
+        try:
+            return getattr(self._get_backend(), method)(*args)
+        except Exception:
+            logger.warning("LLM response cache failed, skipping it", extra={"data": {"method": method}}, exc_info=True)
+            self._retry_at = time.monotonic() + self.retry_interval
+            return None
+
+    async def get(self, request: dict) -> Any | None:
+        """
+        Gets the cached response of a request.
+
+        Args:
+            request: The keyword arguments of the API call.
+
+        Returns:
+            The cached response, or None if it is not cached or the cache failed.
+        """
+        if not self.url:
+            return None
+        value = await asyncio.to_thread(self._call, "get", self.make_key(request), time.time())
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, request: dict, response: Any) -> None:
+        """
+        Caches the response of a request. Nothing is cached if the cache failed.
+
+        Args:
+            request: The keyword arguments of the API call.
+            response: The JSON serializable response.
+        """
+        if not self.url:
+            return
+        now = time.time()
+        await asyncio.to_thread(self._call, "set", self.make_key(request), json.dumps(response), now, now + self.ttl)
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            await asyncio.to_thread(self._call, "evict", now, self.max_entries)
+
+response_cache = ResponseCache(
+    os.getenv("LLM_CACHE_URL", "sqlite:///llm_cache.sqlite3"),
+    ttl=float(os.getenv("LLM_CACHE_TTL", 86400)),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000)),
+)
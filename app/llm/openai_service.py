@@ -1,16 +1,42 @@
 import json
+import os
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
 from app.constants import GPTModel
+from app.llm.scheduler import scheduler
+from app.metrics import record_tokens
 
 
 class OpenAIService:
     def __init__(self):
-        self.client = OpenAI()
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+        # Retries are done by the scheduler, which knows the rate limits of every request
+        self.client = AsyncOpenAI(
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
+
+
+    async def _create(self, request: dict):
+        response = await scheduler.request("openai", self.client.chat.completions.with_raw_response.create, request)
+        if response.usage:
+            details = response.usage.prompt_tokens_details
+            cached = details.cached_tokens if details else None
+            record_tokens(
+                "openai",
+                response.model,
+                input=response.usage.prompt_tokens - (cached or 0),
+                output=response.usage.completion_tokens,
+                cache_read=cached,
+            )
+        return response
 
 
-    def solve_task(self, prompt: str, model: GPTModel = GPTModel.GPT_4o) -> dict[str, str]:
+    async def solve_task(self, prompt: str, model: GPTModel = GPTModel.GPT_4o) -> dict[str, str]:
         """
         Solve a task by generating examples, solution and Python code.
 
@@ -185,7 +211,7 @@ class OpenAIService:
         }
 
         try:
-            response = self.client.chat.completions.create(
+            response = await self._create(dict(
                 model=model,
                 messages=messages,
                 temperature=1,
@@ -194,7 +220,7 @@ class OpenAIService:
                 frequency_penalty=0,
                 presence_penalty=0,
                 response_format=response_format,
-            )
+            ))
             content = response.choices[0].message.content
             if type(content) is str:
                 content = json.loads(content)
@@ -203,7 +229,7 @@ class OpenAIService:
             return f"Error: {e}"
 
 
-    def rewrite_text(self, text: str, model: GPTModel = GPTModel.GPT_4o) -> dict[str, str]:
+    async def rewrite_text(self, text: str, model: GPTModel = GPTModel.GPT_4o) -> dict[str, str]:
         """
         Rewrite text to a single paragraph.
 
@@ -280,7 +306,7 @@ class OpenAIService:
                 },
             },
         }
-        response = self.client.chat.completions.create(
+        response = await self._create(dict(
             model=model,
             messages=messages,
             temperature=1,
@@ -289,14 +315,14 @@ class OpenAIService:
             frequency_penalty=0,
             presence_penalty=0,
             response_format=response_format,
-        )
+        ))
         content = response.choices[0].message.content
         if type(content) is str:
             content = json.loads(content)
         return content
 
 
-    def translate_to_python(self, 
+    async def translate_to_python(self, 
         swift_code: str, model: GPTModel = GPTModel.GPT_4o
     ) -> dict[str, str]:
         """
@@ -340,17 +366,18 @@ class OpenAIService:
             },
         }
 
+        request = dict(
+            model=model,
+            messages=messages,
+            temperature=1,
+            max_tokens=1599,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            response_format=response_format,
+        )
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=1,
-                max_tokens=1599,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
-                response_format=response_format,
-            )
+            response = await self._create(request)
             content = response.choices[0].message.content
             if type(content) is str:
                 content = json.loads(content)
@@ -0,0 +1,402 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import re
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any
+
+import anthropic
+import httpx
+import openai
+
+from app.metrics import LLM_DURATION, LLM_TIME_TO_FIRST_TOKEN
+
+
+class Priority:
+    INTERACTIVE = 0
+    BULK = 1
+
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# The remaining budget and reset headers of each provider, as (requests, tokens)
+RATE_LIMIT_HEADERS = {
+    "anthropic": (
+        ("anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset"),
+        ("anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset"),
+    ),
+    "openai": (
+        ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ),
+}
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_reset(value: str | None) -> float | None:
+    """
+    Parses a reset header, either an RFC 3339 date (Anthropic) or a duration like "6m0s" (OpenAI).
+
+    Args:
+        value: The value of the header.
+
+    Returns:
+        The seconds until the reset, or None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    if "T" in value:
+        try:
+            return max(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() - time.time(), 0)
+        except ValueError:
+            return None
+    parts = _DURATION.findall(value)
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts) if parts else None
+
+
+def _parse_int(value: str | None) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_float(value: str | None) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(request: dict) -> int:
+    """
+    Estimates the tokens a request counts against the budget: about 4 characters per input
+    token plus the max output tokens.
+
+    Args:
+        request: The keyword arguments of the API call.
+
+    Returns:
+        The estimated tokens.
+    """
+    text = json.dumps([request.get("system"), request.get("messages")], default=str)
+    return len(text) // 4 + int(request.get("max_tokens") or 0)
+
+
+class _Budget:
+    def __init__(self, max_concurrency: int):
+        """
+        The rate limit budget of a provider and model, updated from the response headers.
+        None means the remaining amount is unknown, so requests are not held back by it.
+
+        Args:
+            max_concurrency: The max amount of requests in flight.
+        """
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.requests_remaining: int | None = None
+        self.requests_reset = 0.0
+        self.tokens_remaining: int | None = None
+        self.tokens_reset = 0.0
+        self.blocked_until = 0.0
+        self.updated = False
+        self.waiters: list[tuple[int, int, int, asyncio.Future]] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+    def delay(self, tokens: int) -> float | None:
+        """
+        Gets the seconds to wait before a request fits in the budget. Until the first response,
+        and once a spent budget is reset, a single request is sent to learn the new budget from
+        its headers instead of sending a burst.
+
+        Args:
+            tokens: The estimated tokens of the request.
+
+        Returns:
+            The seconds to wait, 0 if it can be sent now, or None to wait for a request in flight.
+        """
+        now = time.monotonic()
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if not self.updated and self.in_flight:
+            return None
+        if self.requests_remaining is not None and self.requests_remaining <= 0:
+            if self.requests_reset > now:
+                return self.requests_reset - now
+            if self.in_flight:
+                return None
+        if self.tokens_remaining is not None and self.tokens_remaining < tokens:
+            if self.tokens_reset > now:
+                return self.tokens_reset - now
+            if self.in_flight:
+                return None
+        return 0
+
+    def reserve(self, tokens: int) -> None:
+        self.in_flight += 1
+        if self.requests_remaining is not None:
+            self.requests_remaining -= 1
+        if self.tokens_remaining is not None:
+            self.tokens_remaining -= tokens
+
+    def update(self, provider: str, headers: httpx.Headers | None) -> None:
+        """
+        Updates the budget from the rate limit headers of a response.
+
+        Args:
+            provider: The name of the provider.
+            headers: The response headers.
+        """
+        self.updated = True
+        if headers is None:
+            return
+        now = time.monotonic()
+        (requests_header, requests_reset_header), (tokens_header, tokens_reset_header) = RATE_LIMIT_HEADERS[provider]
+        self.requests_remaining, self.requests_reset = self._merge(
+            self.requests_remaining, self.requests_reset, headers.get(requests_header), headers.get(requests_reset_header), now
+        )
+        self.tokens_remaining, self.tokens_reset = self._merge(
+            self.tokens_remaining, self.tokens_reset, headers.get(tokens_header), headers.get(tokens_reset_header), now
+        )
+
+    @staticmethod
+    def _merge(
+        remaining: int | None, reset: float, remaining_header: str | None, reset_header: str | None, now: float
+    ) -> tuple[int | None, float]:
+        new_remaining = _parse_int(remaining_header)
+        new_reset = _parse_reset(reset_header)
+        if new_remaining is None or new_reset is None:
+            return remaining, reset
+        new_reset += now
+        # Responses of the same window arrive in any order, so the lowest remaining amount is the current one
+        if remaining is not None and now < reset and new_reset <= reset + 0.1:
+            return min(remaining, new_remaining), reset
+        return new_remaining, new_reset
+
+
+class RateLimitScheduler:
+    def __init__(self, max_concurrency: int = 16, max_retries: int = 4, backoff: float = 1.0, max_backoff: float = 60.0):
+        """
+        Shared scheduler of the LLM requests. It keeps a budget per provider and model from the
+        rate limit headers of the responses, holds requests in a priority queue (interactive
+        before bulk) until they fit in the budget, and retries rate limited, overloaded and
+        failed connections with jittered exponential backoff.
+
+        Args:
+            max_concurrency: The max amount of requests in flight per provider and model.
+            max_retries: The max amount of retries of a request.
+            backoff: The base seconds of the backoff.
+            max_backoff: The max seconds of the backoff.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self._budgets: dict[tuple[str, str], _Budget] = {}
+        self._counter = itertools.count()
+
+    def _budget(self, provider: str, model: str) -> _Budget:
+        key = (provider, str(model))
+        if key not in self._budgets:
+            self._budgets[key] = _Budget(self.max_concurrency)
+        return self._budgets[key]
+
+    def stats(self) -> dict:
+        """
+        Gets the state of every budget and the amount of retries.
+
+        Returns:
+            The requests in flight and queued, and the last known remaining budget per provider and model.
+        """
+        return {
+            "retries": self.retries,
+            "budgets": {
+                f"{provider}/{model}": {
+                    "in_flight": budget.in_flight,
+                    "queued": sum(not future.done() for *_, future in budget.waiters),
+                    "requests_remaining": budget.requests_remaining,
+                    "tokens_remaining": budget.tokens_remaining,
+                }
+                for (provider, model), budget in self._budgets.items()
+            },
+        }
+
+    def _dispatch(self, budget: _Budget) -> None:
+        if budget.timer is not None:
+            budget.timer.cancel()
+            budget.timer = None
+        while budget.waiters:
+            _, _, tokens, future = budget.waiters[0]
+            if future.done():  # Cancelled while waiting
+                heapq.heappop(budget.waiters)
+                continue
+            if budget.in_flight >= budget.max_concurrency:
+                return  # Dispatched again when a request finishes
+            delay = budget.delay(tokens)
+            if delay is None:
+                return  # Dispatched again when a request finishes
+            if delay > 0:
+                budget.timer = asyncio.get_running_loop().call_later(delay, self._dispatch, budget)
+                return
+            heapq.heappop(budget.waiters)
+            budget.reserve(tokens)
+            future.set_result(None)
+
+    async def _acquire(self, budget: _Budget, tokens: int, priority: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(budget.waiters, (priority, next(self._counter), tokens, future))
+        self._dispatch(budget)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(budget)
+            raise
+
+    def _release(self, budget: _Budget, provider: str | None = None, headers: httpx.Headers | None = None) -> None:
+        budget.in_flight -= 1
+        if provider:
+            budget.update(provider, headers)
+        self._dispatch(budget)
+
+    def _retry_delay(self, budget: _Budget, error: Exception, attempt: int) -> float | None:
+        """
+        Gets the seconds to wait before retrying a failed request, and blocks the budget for that
+        time when the provider rate limited it.
+
+        Args:
+            budget: The budget of the request.
+            error: The error of the request.
+            attempt: The number of the failed attempt, starting at 0.
+
+        Returns:
+            The seconds to wait, or None if the error is not retried.
+        """
+        status = getattr(error, "status_code", None)
+        connection_error = isinstance(error, (anthropic.APIConnectionError, openai.APIConnectionError))
+        if attempt >= self.max_retries or not (connection_error or status in RETRY_STATUSES):
+            return None
+        # Full jitter, so the requests rate limited at once do not retry at once
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = _parse_float(response.headers.get("retry-after"))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_backoff))
+        if status == 429:
+            budget.blocked_until = max(budget.blocked_until, time.monotonic() + delay)
+        return delay
+
+    async def request(
+        self, provider: str, create: Callable[..., Awaitable[Any]], request: dict, priority: int = Priority.INTERACTIVE
+    ) -> Any:
+        """
+        Sends a request when it fits in the budget, retrying it if it fails.
+
+        Args:
+            provider: The name of the provider, "anthropic" or "openai".
+            create: The with_raw_response create method of the client.
+            request: The keyword arguments of the API call.
+            priority: The priority of the request.
+
+        Returns:
+            The parsed response.
+        """
+        budget = self._budget(provider, request["model"])
+        tokens = estimate_tokens(request)
+        for attempt in itertools.count():
+            await self._acquire(budget, tokens, priority)
+            started = time.perf_counter()
+            try:
+                response = await create(**request)
+            except Exception as e:
+                self._release(budget, provider, getattr(getattr(e, "response", None), "headers", None))
+                delay = self._retry_delay(budget, e, attempt)
+                if delay is None:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled, e.g. the client disconnected. The budget is marked as updated, so the
+                # waiters do not wait forever for the response of a probe that never arrives
+                self._release(budget, provider)
+                raise
+            self._release(budget, provider, response.headers)
+            LLM_DURATION.labels(provider, request["model"]).observe(time.perf_counter() - started)
+            return response.parse()
+
+    @asynccontextmanager
+    async def stream(
+        self, provider: str, open_stream: Callable[..., Any], request: dict, priority: int = Priority.INTERACTIVE
+    ) -> AsyncIterator[Any]:
+        """
+        Opens a stream when it fits in the budget. Only opening the stream is retried, since the
+        caller may have used the events of a stream that fails later. The text_stream of the
+        stream is wrapped to time the first token.
+
+        Args:
+            provider: The name of the provider.
+            open_stream: The stream method of the client, returning an async context manager.
+            request: The keyword arguments of the API call.
+            priority: The priority of the request.
+
+        Returns:
+            The open stream.
+        """
+        budget = self._budget(provider, request["model"])
+        tokens = estimate_tokens(request)
+        for attempt in itertools.count():
+            await self._acquire(budget, tokens, priority)
+            started = time.perf_counter()
+            manager = open_stream(**request)
+            try:
+                stream = await manager.__aenter__()
+            except Exception as e:
+                self._release(budget, provider, getattr(getattr(e, "response", None), "headers", None))
+                delay = self._retry_delay(budget, e, attempt)
+                if delay is None:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled while opening the stream, released like in request
+                self._release(budget, provider)
+                raise
+            break
+        stream.text_stream = self._time_first_token(stream.text_stream, provider, request["model"], started)
+        try:
+            yield stream
+        finally:
+            try:
+                await manager.__aexit__(None, None, None)
+            finally:
+                self._release(budget, provider, stream.response.headers)
+            LLM_DURATION.labels(provider, request["model"]).observe(time.perf_counter() - started)
+
+    @staticmethod
+    async def _time_first_token(
+        text_stream: AsyncIterator[str], provider: str, model: str, started: float
+    ) -> AsyncIterator[str]:
+        first = True
+        async for text in text_stream:
+            if first:
+                LLM_TIME_TO_FIRST_TOKEN.labels(provider, model).observe(time.perf_counter() - started)
+                first = False
+            yield text
+
+
+scheduler = RateLimitScheduler(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 16)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", 4)),
+)
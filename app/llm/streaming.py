@@ -0,0 +1,240 @@
+import json
+from collections.abc import AsyncIterator
+from typing import Any
+
+
+def format_sse(event: str, data: Any) -> str:
+    """
+    Formats an event as a server-sent event.
+
+    Args:
+        event: The name of the event.
+        data: The data of the event, sent as JSON.
+
+    Returns:
+        The server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def to_sse(events: AsyncIterator[dict]) -> AsyncIterator[str]:
+    """
+    Formats the events of a streaming service method as server-sent events. An error ends the
+    stream with an error event, since the response status was already sent.
+
+    Args:
+        events: The events, as dictionaries with the event name and data.
+
+    Returns:
+        The server-sent events.
+    """
+    try:
+        async for event in events:
+            yield format_sse(event["event"], event["data"])
+    except Exception as e:
+        yield format_sse("error", f"Error: {e}")
+
+
+class JsonFieldParser:
+    """
+    Incremental JSON parser that reports every scalar value as soon as it is complete, with the
+    path of keys and indexes that leads to it. Any text before the first object is ignored.
+    """
+
+    _DELIMITERS = ",}] \n\r\t"
+
+    def __init__(self):
+        # Each frame is [is_object, key or index, expecting_key]
+        self._stack: list[list] = []
+        self._string: list[str] | None = None
+        self._escape = False
+        self._literal: str | None = None
+        self._done = False
+
+    def feed(self, text: str) -> list[tuple[list, Any]]:
+        """
+        Feeds the next piece of the JSON text.
+
+        Args:
+            text: The next piece of the text.
+
+        Returns:
+            The (path, value) of the values completed by this piece.
+        """
+        fields = []
+        for char in text:
+            if self._done:
+                break
+            if self._string is not None:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    raw = "".join(self._string)
+                    self._string = None
+                    try:
+                        value = json.loads(f'"{raw}"')
+                    except json.decoder.JSONDecodeError:
+                        value = raw
+                    self._on_string(value, fields)
+                    continue
+                self._string.append(char)
+                continue
+            if self._literal is not None:
+                if char not in self._DELIMITERS:
+                    self._literal += char
+                    continue
+                try:
+                    value = json.loads(self._literal)
+                except json.decoder.JSONDecodeError:
+                    value = self._literal
+                self._literal = None
+                fields.append((self._path(), value))
+
+            if not self._stack:
+                if char == "{":
+                    self._stack.append([True, None, True])
+                continue
+            frame = self._stack[-1]
+            if char == '"':
+                self._string = []
+            elif char == "{":
+                self._stack.append([True, None, True])
+            elif char == "[":
+                self._stack.append([False, 0, False])
+            elif char in "}]":
+                self._stack.pop()
+                self._done = not self._stack
+            elif char == ":":
+                frame[2] = False
+            elif char == ",":
+                if frame[0]:
+                    frame[2] = True
+                else:
+                    frame[1] += 1
+            elif not char.isspace():
+                self._literal = char
+        return fields
+
+    def _on_string(self, value: str, fields: list[tuple[list, Any]]) -> None:
+        frame = self._stack[-1]
+        if frame[0] and frame[2]:
+            frame[1] = value
+        else:
+            fields.append((self._path(), value))
+
+    def _path(self) -> list:
+        return [frame[1] for frame in self._stack]
+
+
+class CodeBlockParser:
+    """
+    Incremental parser of the fenced code blocks of a markdown text, reporting each block as soon
+    as its closing fence arrives.
+    """
+
+    def __init__(self):
+        self._line = ""
+        self._language: str | None = None
+        self._code: list[str] = []
+
+    def feed(self, text: str) -> list[dict[str, str]]:
+        """
+        Feeds the next piece of the text.
+
+        Args:
+            text: The next piece of the text.
+
+        Returns:
+            The code blocks completed by this piece, with their language and code.
+        """
+        blocks = []
+        *lines, self._line = (self._line + text).split("\n")
+        for line in lines:
+            if line.strip().startswith("```"):
+                if self._language is None:
+                    self._language = line.strip()[3:].strip()
+                    self._code = []
+                else:
+                    blocks.append({"language": self._language, "code": "\n".join(self._code)})
+                    self._language = None
+            elif self._language is not None:
+                self._code.append(line)
+        return blocks
+
+
+class TurnParser:
+    """
+    Incremental parser of the "U:" / "A:" conversation turns. The user part of a turn is reported
+    when its "A:" line starts, and the assistant part when the next "U:" line starts or the text
+    ends. The lines of each part are only joined once, when the part is complete.
+    """
+
+    def __init__(self):
+        self.turns: list[dict[str, str]] = []
+        self._line = ""
+        self._user: list[str] | None = None
+        self._assistant: list[str] | None = None
+
+    def feed(self, text: str) -> list[dict]:
+        """
+        Feeds the next piece of the text.
+
+        Args:
+            text: The next piece of the text.
+
+        Returns:
+            The parts completed by this piece, with the turn index, role and text.
+        """
+        parts = []
+        *lines, self._line = (self._line + text).split("\n")
+        for line in lines:
+            self._feed_line(line, parts)
+        return parts
+
+    def close(self) -> list[dict]:
+        """
+        Ends the text, completing the last turn.
+
+        Returns:
+            The parts completed by the end of the text.
+        """
+        parts = []
+        self._feed_line(self._line, parts)
+        self._line = ""
+        self._finish_turn(parts)
+        return parts
+
+    def _feed_line(self, line: str, parts: list[dict]) -> None:
+        if line.startswith("U:"):
+            self._finish_turn(parts)
+            self._user = [line[2:].strip().replace('"', "")]
+        elif line.startswith("A:"):
+            if self._user is None:
+                return
+            if self._assistant is None:
+                parts.append(self._part("user", self._user_text()))
+            self._assistant = [line[2:].strip().replace('"', "")]
+        elif self._assistant is not None:
+            self._assistant.append(line)
+        elif self._user is not None:
+            self._user.append(line)
+
+    def _finish_turn(self, parts: list[dict]) -> None:
+        if self._user is None:
+            return
+        turn = {"user": self._user_text()}
+        if self._assistant is None:
+            parts.append(self._part("user", turn["user"]))
+        else:
+            turn["assistant"] = "\n".join(self._assistant)
+            parts.append(self._part("assistant", turn["assistant"]))
+        self.turns.append(turn)
+        self._user = self._assistant = None
+
+    def _user_text(self) -> str:
+        return "\n".join(self._user).strip()
+
+    def _part(self, role: str, text: str) -> dict:
+        return {"index": len(self.turns), "role": role, "text": text}
@@ -0,0 +1,168 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from collections.abc import Callable
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+
+# ID of the API request being handled, set by RequestIdMiddleware and copied to the jobs and Drive threads
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+logger = logging.getLogger("app")
+
+_REQUEST_ID_PATTERN = re.compile(rb"[A-Za-z0-9._-]{1,64}")
+
+
+def _truncate(value, max_length: int):
+    if isinstance(value, str):
+        return value if len(value) <= max_length else f"{value[:max_length]}... ({len(value)} chars)"
+    if isinstance(value, dict):
+        return {key: _truncate(item, max_length) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_truncate(item, max_length) for item in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_length: int = 2000):
+        """
+        Format records as one JSON object per line. The fields passed in extra={"data": {...}} are
+        nested under "data", so they cannot overwrite the fields of the record. Strings longer than the max length are truncated, so a LLM response does not flood the logs
+
+        :param max_length: The max characters of each string field
+        """
+        super().__init__()
+        self.max_length = max_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage(), self.max_length),
+            "request_id": getattr(record, "request_id", None),
+        }
+        data = getattr(record, "data", None)
+        if data:
+            entry["data"] = _truncate(data, self.max_length)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue, sample_rate: float):
+        """
+        Hand the records to the listener thread, which formats and writes them, so logging from the
+        event loop does not wait for stdout. Records below WARNING are sampled, and they are
+        dropped instead of blocking when the queue is full
+
+        :param log_queue: The queue read by the listener
+        :param sample_rate: The fraction of the records below WARNING that are kept
+        """
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return False
+        # Read here because the context of the caller is not available in the listener thread
+        record.request_id = request_id.get()
+        return super().filter(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the default, the record is not formatted here. Only the traceback is, since it
+        # references the frames of the caller
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging() -> None:
+    """
+    Send the logs of the app through a queue to a JSON handler on stdout. The level, sample rate of
+    records below WARNING, max string length and queue size can be set with LOG_LEVEL,
+    LOG_SAMPLE_RATE, LOG_MAX_FIELD_LENGTH and LOG_QUEUE_SIZE
+    """
+    global _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter(int(os.getenv("LOG_MAX_FIELD_LENGTH", 2000))))
+    log_queue = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger.addHandler(_QueueHandler(log_queue, float(os.getenv("LOG_SAMPLE_RATE", 1))))
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+class RequestIdMiddleware:
+    HEADER = "x-request-id"
+
+    def __init__(self, app: Callable):
+        """
+        ASGI middleware that gives each request an ID, taken from the X-Request-ID header if the
+        client sends a valid one (up to 64 letters, digits, ".", "_" or "-"). The ID is returned in the same header and added to every log of the request
+
+        :param app: The ASGI app
+        """
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # Other values are replaced, since the ID is echoed in the response headers and the logs
+        header = dict(scope["headers"]).get(self.HEADER.encode(), b"")
+        current_id = header.decode() if _REQUEST_ID_PATTERN.fullmatch(header) else uuid.uuid4().hex
+        token = request_id.set(current_id)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (self.HEADER.encode(), current_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            logger.info(
+                "request",
+                extra={"data": {
+                    "method": scope["method"],
+                    "route": getattr(route, "path", scope["path"]),
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                }},
+            )
+            request_id.reset(token)
@@ -3,14 +3,22 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.routers.conversations import router as conversations_router
 from app.routers.google_drive import router as google_drive_router
+from app.routers.jobs import router as jobs_router
+from app.logs import RequestIdMiddleware, setup_logging
+from app.metrics import MetricsMiddleware
 from app.routers.llm import router as llm_router
+from app.routers.metrics import router as metrics_router
 
 
+setup_logging()
+
 app = FastAPI()
 
 app.include_router(conversations_router)
 app.include_router(google_drive_router)
+app.include_router(jobs_router)
 app.include_router(llm_router)
+app.include_router(metrics_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,3 +27,5 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
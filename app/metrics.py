@@ -0,0 +1,109 @@
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latency of the API requests until the response is sent",
+    ["method", "route", "status"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120),
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Seconds until the first token of a streamed LLM response",
+    ["provider", "model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+LLM_DURATION = Histogram(
+    "llm_request_duration_seconds",
+    "Seconds until a LLM response is complete",
+    ["provider", "model"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 240),
+)
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "Tokens of the LLM requests by type: input, output, cache_read or cache_write",
+    ["provider", "model", "type"],
+)
+DRIVE_DURATION = Histogram(
+    "drive_api_call_duration_seconds",
+    "Seconds of the Google Drive API calls, including retries. The _count is the amount of calls",
+    ["method"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+DRIVE_ERRORS = Counter("drive_api_call_errors", "Google Drive API calls that failed", ["method"])
+
+
+def record_tokens(provider: str, model: str, **tokens: int | None) -> None:
+    """
+    Add the tokens of a LLM response to the counters
+
+    :param provider: The name of the provider
+    :param model: The model of the response
+    :param tokens: The amount of tokens by type, e.g. input=10, output=5. None counts as 0
+    """
+    for token_type, amount in tokens.items():
+        if amount:
+            LLM_TOKENS.labels(provider, model, token_type).inc(amount)
+
+
+@contextmanager
+def drive_call(method: str):
+    """
+    Time a Google Drive API call
+
+    :param method: The ID of the API method, e.g. drive.files.list
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DRIVE_ERRORS.labels(method).inc()
+        raise
+    finally:
+        DRIVE_DURATION.labels(method).observe(time.perf_counter() - started)
+
+
+class MetricsMiddleware:
+    def __init__(self, app: Callable):
+        """
+        ASGI middleware that observes the latency of every request, labeled by the route template
+        (e.g. /jobs/{job_id}) so path parameters do not create a series per value. Streamed
+        responses are observed when the last chunk is sent
+
+        :param app: The ASGI app
+        """
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                self._observe(scope, status, started)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            self._observe(scope, 500, started)
+            raise
+
+    @staticmethod
+    def _observe(scope: dict, status: int, started: float) -> None:
+        # The router stores the matched route in the scope
+        route = scope.get("route")
+        REQUEST_DURATION.labels(
+            scope["method"], getattr(route, "path", "unmatched"), str(status)
+        ).observe(time.perf_counter() - started)
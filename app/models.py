@@ -17,26 +17,24 @@ class BlockType:
     UNKNOWN = "Unknown"
 
 
-class Block(BaseModel):
-    content: str
-
-    class Config:
-        arbitrary_types_allowed = True
+class Block:
+    __slots__ = ("content", "lines", "type")
 
     def __init__(self, cell: NotebookNode):
         """
-        Represents a block of code or text
+        Represents a block of code or text. The block is classified once on creation
 
         :param cell: The cell to be represented as a block
         """
-        super().__init__(content=cell.source)
-        self._cell = cell
+        self.content: str = cell.source
+        self.lines: list[str] = self.content.split("\n")
+        self.type: str = self._classify(cell)
 
-    @property
-    def type(self) -> str:
+    def _classify(self, cell: NotebookNode) -> str:
         """
         Get the type of the block
 
+        :param cell: The cell represented by the block
         :return: The type of the block
         """
         if self.content.startswith("# Prompt"):
@@ -45,18 +43,42 @@ class Block(BaseModel):
             return BlockType.SOLUTION
         elif self.content.startswith("# Python Answer"):
             return BlockType.PYTHON_HEADER
-        elif is_python_code(self._cell):
+        elif is_python_code(cell, self.lines):
             if "import unittest" in self.content or "assert " in self.content:
                 return BlockType.PYTHON_TEST
             return BlockType.PYTHON_CODE
         elif self.content.startswith("# Swift Answer"):
             return BlockType.SWIFT_HEADER
-        elif is_swift_code(self._cell):
+        elif is_swift_code(cell, self.lines):
             if "import XCTest" in self.content or "assert(" in self.content:
                 return BlockType.SWIFT_TEST
             return BlockType.SWIFT_CODE
         return BlockType.UNKNOWN
 
+    def __repr__(self) -> str:
+        return f"Block(type={self.type!r}, lines={len(self.lines)})"
+
+
+class ParsedNotebook:
+    def __init__(self, colab_file: NotebookNode):
+        """
+        Parses a Google Colab file once so every check can share the result
+
+        :param colab_file: The Google Colab file to be parsed
+        """
+        self.blocks = [Block(cell) for cell in colab_file.cells]
+
+    def __iter__(self):
+        """
+        Iterate over the blocks with their type and lines
+
+        :return: An iterator of (block, block type, lines) tuples
+        """
+        return ((block, block.type, block.lines) for block in self.blocks)
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
 
 class StructureError(BaseModel):
     line_number: int
@@ -81,7 +103,11 @@ class StructureError(BaseModel):
             line_text=line_text,
             error_message=f"{error_message}.\nBlock: {block.type}\nLine {line_number}: {line_text}"
         )
-        self.block = block
+        self._block = block
+
+    @property
+    def block(self) -> Block:
+        return self._block
 
 
 # Request bodies
@@ -108,6 +134,10 @@ class GenerateTestCodeRequest(BaseModel):
     prompt: str
     answer: str
 
+class FullComparisonRequest(CompareResponsesRequest):
+    answer: str
+    generate_turns: bool = False
+
 class ReEvaluateResponsesRequest(CompareResponsesRequest):
     comparison_response: str
     requested_changes: str
@@ -121,3 +151,4 @@ class UploadScreenshot(BaseModel):
 class UploadScreenshotsRequest(BaseModel):
     task_id: str
     images: list[UploadScreenshot]
+    save_local: bool = False
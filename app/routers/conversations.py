@@ -1,7 +1,11 @@
+import asyncio
+import time
+
 from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
 
-from app.services import check_for_snake_case_functions, check_prompt_block, check_for_test_cases
-from app.utils.services import save_to_files, load_colab_file
+from app.services import get_review_pool, review_colab_content, review_notebook_content, stream_review_results
+from app.utils.services import detach_upload, iter_colab_files, save_to_files
 
 
 router = APIRouter(prefix="/conversations")
@@ -22,14 +26,51 @@ async def review_conversation(file: UploadFile = File(...), save_file: bool = Fa
 
     if save_file:
         save_to_files(file, path=file.filename)
+        file.file.seek(0)
+
+    return review_colab_content(file.file.read())
+
+
+async def _stream_batch(files: list[UploadFile]):
+    try:
+        async for line in stream_review_results(iter_colab_files(files)):
+            yield line
+    finally:
+        for file in files:
+            file.file.close()
+
+
+@router.post("/review/batch")
+async def review_conversations_batch(files: list[UploadFile] = File(...), stream: bool = False):
+    """
+    Review many conversations at once. The files can be .ipynb files or zip archives with them,
+    and they are reviewed in parallel by a process pool
+
+    :param files: The Google Colab files or zip archives to be reviewed
+    :param stream: If the results should be streamed as newline-delimited JSON as each file finishes
+    :return: A dictionary with the review result and timing of each file
+    """
+    for file in files:
+        if not file.filename.endswith((".ipynb", ".zip")):
+            raise HTTPException(status_code=400, detail=f"Invalid file format: {file.filename}")
+
+    if stream:
+        # The uploads are closed when this function returns, so the stream reads from its own copies
+        return StreamingResponse(_stream_batch([detach_upload(file) for file in files]), media_type="application/x-ndjson")
 
-    colab_file = load_colab_file(file=file)
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    pool = get_review_pool()
+    try:
+        tasks = [
+            loop.run_in_executor(pool, review_notebook_content, file_name, content)
+            for file_name, content in iter_colab_files(files)
+        ]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    prompt_errors = check_prompt_block(colab_file)
-    snake_case_errors = check_for_snake_case_functions(colab_file)
-    test_case_errors = check_for_test_cases(colab_file)
+    results = await asyncio.gather(*tasks)
     return {
-        "prompt_errors": prompt_errors,
-        "snake_case_errors": snake_case_errors,
-        "test_case_errors": test_case_errors
+        "results": results,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
     }
@@ -1,7 +1,9 @@
 from app.models import UploadScreenshotsRequest
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 
 from app.google_drive.services import GoogleDriveService
+from app.routers.jobs import submit_job
 
 router = APIRouter(prefix="/gdrive")
 gdrive = GoogleDriveService()
@@ -15,11 +17,16 @@ async def create_folders(task_id: str):
     :param task_id: The ID of the task
     :return: A dictionary with the model A and B folder IDs
     """
-    response = gdrive.create_task_folders(task_id)
+    response = await run_in_threadpool(gdrive.create_task_folders, task_id)
     return response
 
 
 @router.post("/upload-screenshots")
-async def upload_screenshots(body: UploadScreenshotsRequest):
-    response = gdrive.create_task_screenshots(body.task_id, body.images)
+async def upload_screenshots(body: UploadScreenshotsRequest, background: bool = False):
+    if background:
+        return submit_job(
+            "upload_screenshots",
+            lambda: run_in_threadpool(gdrive.create_task_screenshots, body.task_id, body.images, body.save_local),
+        )
+    response = await run_in_threadpool(gdrive.create_task_screenshots, body.task_id, body.images, body.save_local)
     return response
@@ -0,0 +1,41 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from fastapi import APIRouter, HTTPException
+
+from app.jobs.services import jobs
+
+
+router = APIRouter(prefix="/jobs")
+
+
+def submit_job(name: str, func: Callable[[], Awaitable[Any]]) -> dict:
+    """
+    Run a call in the background job queue
+
+    :param name: The name of the operation
+    :param func: Returns the awaitable that runs the call
+    :return: The job, whose ID can be polled in /jobs/{job_id}
+    """
+    try:
+        return jobs.submit(name, func).to_dict()
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Too many pending jobs, try again later")
+
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Get the status and result of a background job
+
+    :param job_id: The ID of the job
+    :param wait: The max seconds to wait for the job to finish before answering
+    :return: The job
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0:
+        await jobs.wait(job, min(wait, 60))
+    return job.to_dict()
@@ -1,21 +1,42 @@
-from fastapi import APIRouter
+import asyncio
+import logging
+import os
+
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 
 from app.llm.anthropic_service import AnthropicService
+from app.llm.batches import BulkComparisons
 from app.llm.openai_service import OpenAIService
+from app.llm.scheduler import Priority, scheduler
+from app.llm.streaming import to_sse
 from app.models import (
     CompareResponsesRequest,
+    FullComparisonRequest,
     GenerateTestCodeRequest,
     ReEvaluateResponsesRequest,
     RewriteRequest,
     SolveTaskRequest,
     TranslateCodeRequest,
 )
+from app.routers.jobs import submit_job
 
 
 router = APIRouter(prefix="/llm")
+logger = logging.getLogger(__name__)
 
 anthropic = AnthropicService()
 openai = OpenAIService()
+bulk_comparisons = BulkComparisons(
+    anthropic,
+    results_dir=os.getenv("LLM_BATCH_RESULTS_DIR", "bulk_results"),
+    max_requests=int(os.getenv("LLM_BATCH_MAX_REQUESTS", 10000)),
+    # The Message Batches API rejects batches over 256 MB
+    max_bytes=int(os.getenv("LLM_BATCH_MAX_BYTES", 200 * 1024 * 1024)),
+    poll_interval=float(os.getenv("LLM_BATCH_POLL_INTERVAL", 30)),
+)
+# Batches take up to 24 hours, so the unfinished bulk comparisons are resumed when the server restarts
+router.add_event_handler("startup", bulk_comparisons.resume)
 
 
 @router.post("/translation/solve")
@@ -24,8 +45,8 @@ async def solve(body: SolveTaskRequest):
     Solve a task
     """
     # return {"examples":[{"input":[{"var_name":"nums","value":"[1, 2, 3, 4, 5, 6, 7]"},{"var_name":"k","value":"3"}],"output":"[5, 6, 7, 1, 2, 3, 4]","explanation":"The list is rotated 3 positions to the right: [5, 6, 7, 1, 2, 3, 4]. Each segment is rotated in parallel threads."},{"input":[{"var_name":"nums","value":"[10, 20, 30, 40, 50]"},{"var_name":"k","value":"1"}],"output":"[50, 10, 20, 30, 40]","explanation":"The list is rotated 1 position to the right: [50, 10, 20, 30, 40]."},{"input":[{"var_name":"nums","value":"[7, 8, 9, 1, 2]"},{"var_name":"k","value":"2"}],"output":"[1, 2, 7, 8, 9]","explanation":"The list is rotated 2 positions to the right: [1, 2, 7, 8, 9]."}],"solution":"To rotate the list to the right by k positions using multiple threads, start by calculating the effective rotation k as k mod len(nums). Given that calculating each rotation can be thought of independently, split the list into segments that can be processed concurrently by threads. Each thread will rotate its segment individually, and then results are combined. The default rotate_segment function shifts items in `segment` based on provided `k` its length.","python_code":"from threading import Thread\n\ndef rotate_segment(segment: list, k: int) -> list:\n    n = len(segment)\n    k = k % n  # Effective rotation\n    return segment[-k:] + segment[:-k]\n\n\ndef rotate_list(nums: list, k: int) -> list:\n    n = len(nums)\n    if n == 0:\n        return []\n    k = k % n  # Effective rotation\n\n    num_threads = min(4, n)  # Use up to 4 threads\n    step = n // num_threads\n    segments = [nums[i:i + step] for i in range(0, n, step)]\n\n    # Handles the last segment if splitting doesn't divide evenly\n    if len(segments) > num_threads:\n        segments[-2].extend(segments[-1])\n        segments.pop()\n\n    rotated_segments = [None] * len(segments)\n\n    def rotate_and_store(segment_id):\n        rotated_segments[segment_id] = rotate_segment(segments[segment_id], k)\n\n    threads = []\n    for i in range(len(segments)):\n        thread = Thread(target=rotate_and_store, args=(i,))\n        threads.append(thread)\n        thread.start()\n\n    for thread in threads:\n        thread.join()\n\n    # Concatenate segments to form final rotated list\n    rotated_list = [item for segment in rotated_segments for item in segment]\n\n    # Rotate back the concatenated result\n    return rotated_list[-k:] + rotated_list[:-k]\n\n# Example usage:\nassert rotate_list([1, 2, 3, 4, 5, 6, 7], 3) == [5, 6, 7, 1, 2, 3, 4]  # Test rotation of 3\nassert rotate_list([10, 20, 30, 40, 50], 1) == [50, 10, 20, 30, 40]  # Test rotation of 1\nassert rotate_list([7, 8, 9, 1, 2], 2) == [1, 2, 7, 8, 9]  # Test rotation of 2\nassert rotate_list([], 5) == []  # Edge case: empty list\nassert rotate_list([1], 0) == [1]  # Edge case: single element\n"}
-    res = openai.solve_task(body.prompt)
-    print(res)
+    res = await openai.solve_task(body.prompt)
+    logger.info("solve_task", extra={"data": {"response": res}})
     return res
 
 
@@ -34,8 +55,8 @@ async def rewrite(body: RewriteRequest):
     """
     rewrite a text
     """
-    res = openai.rewrite_text(body.text)
-    print(res)
+    res = await openai.rewrite_text(body.text)
+    logger.info("rewrite_text", extra={"data": {"response": res}})
     return res
 
 
@@ -45,8 +66,8 @@ async def translate(body: TranslateCodeRequest):
     Translate from Swift to Python
     """
     # return {"code":"from typing import List, Tuple\n\n\ndef find_parallel_topological_order(n: int, edges: List[Tuple[int, int]]) -> List[List[int]]:\n    \"\"\"\n    Finds a valid topological order of tasks in a directed acyclic graph (DAG).\n    Each inner list contains the tasks that can be completed in parallel at the same time step.\n\n    :param n: The number of nodes (tasks) in the graph.\n    :param edges: A list of directed edges representing dependencies between tasks.\n    :return: A list of lists, where each inner list contains tasks that can be completed in parallel.\n    \"\"\"\n    # Create an adjacency list and an array to count in-degrees\n    adj_list = [[] for _ in range(n)]\n    in_degree = [0] * n\n\n    # Build the graph\n    for u, v in edges:\n        adj_list[u].append(v)\n        in_degree[v] += 1\n\n    # Initialize a queue with all nodes having no incoming edges (in-degree 0)\n    queue = [i for i in range(n) if in_degree[i] == 0]\n\n    # Prepare to hold the result\n    result = []\n\n    # Perform a modified Kahn's algorithm to process nodes in topological order\n    while queue:\n        # Current level of tasks that can be completed in parallel\n        current_level = []\n\n        # Process all nodes at the current level\n        for _ in range(len(queue)):\n            node = queue.pop(0)\n            current_level.append(node)\n\n            # Decrease the in-degree of adjacent nodes\n            for neighbor in adj_list[node]:\n                in_degree[neighbor] -= 1\n                if in_degree[neighbor] == 0:\n                    queue.append(neighbor)\n\n        # Add the current level to the result\n        result.append(current_level)\n\n    return result\n"}
-    res = openai.translate_to_python(body.code)
-    print(res)
+    res = await openai.translate_to_python(body.code)
+    logger.info("translate_to_python", extra={"data": {"response": res}})
     return res
 
 
@@ -55,23 +76,96 @@ async def generate_turns(body: SolveTaskRequest):
     """
     Generate turns for a conversation
     """
-    res = anthropic.generate_turns(body.prompt, language=body.language)
-    print(res)
+    res = await anthropic.generate_turns(body.prompt, language=body.language)
+    logger.info("generate_turns", extra={"data": {"response": res}})
     return res
 
 
+@router.post("/comparison/generate-turns/stream")
+async def generate_turns_stream(body: SolveTaskRequest):
+    """
+    Generate turns for a conversation, streaming each turn as a server-sent event once it is complete
+    """
+    events = anthropic.stream_generate_turns(body.prompt, language=body.language)
+    return StreamingResponse(to_sse(events), media_type="text/event-stream")
+
+
 @router.post("/comparison/compare")
-async def compare(body: CompareResponsesRequest):
+async def compare(body: CompareResponsesRequest, background: bool = False):
     """
-    Evaluate two models
+    Evaluate two models. With background, the comparison runs as a job and its ID is returned
     """
-    res = anthropic.compare_responses(**body.model_dump())
-    print(res)
+    if background:
+        return submit_job(
+            "compare", lambda: anthropic.compare_responses(**body.model_dump(), priority=Priority.BULK)
+        )
+    res = await anthropic.compare_responses(**body.model_dump())
+    logger.info("compare_responses", extra={"data": {"response": res}})
+    return res
+
+@router.post("/comparison/compare/stream")
+async def compare_stream(body: CompareResponsesRequest):
+    """
+    Evaluate two models, streaming the tokens and each completed field as server-sent events
+    """
+    events = anthropic.stream_compare_responses(**body.model_dump())
+    return StreamingResponse(to_sse(events), media_type="text/event-stream")
+
+@router.post("/comparison/bulk")
+async def compare_bulk(file: UploadFile = File(...), provider: str = os.getenv("LLM_BATCH_PROVIDER", "anthropic")):
+    """
+    Evaluate many pairs of models from a JSONL file through the batch API. Each line has the
+    fields of /comparison/compare and an optional "id". Use provider=mock to test it locally
+    """
+    if provider not in bulk_comparisons.providers:
+        raise HTTPException(status_code=400, detail=f"Unknown provider {provider}")
+    return bulk_comparisons.start(provider, file.file.read().splitlines()).to_dict()
+
+@router.get("/comparison/bulk/{bulk_id}")
+async def get_bulk_comparison(bulk_id: str):
+    """
+    Progress of a bulk comparison
+    """
+    run = bulk_comparisons.get(bulk_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Bulk comparison not found")
+    return run.to_dict()
+
+@router.get("/comparison/bulk/{bulk_id}/results")
+async def get_bulk_comparison_results(bulk_id: str):
+    """
+    Results of a bulk comparison as JSONL, one line per input with its id, result and error.
+    The file grows while the batches end
+    """
+    run = bulk_comparisons.get(bulk_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Bulk comparison not found")
+    return FileResponse(run.output_path, media_type="application/x-ndjson", filename=f"{bulk_id}.jsonl")
+
+@router.post("/comparison/full")
+async def full_comparison(body: FullComparisonRequest):
+    """
+    Compare two models, generate the test code of the answer and optionally the turns, all at once
+    """
+    calls = {
+        "comparison": anthropic.compare_responses(
+            body.prompt, body.model_a, body.model_b, body.output, language=body.language
+        ),
+        "test_code": anthropic.generate_test_code(body.prompt, body.answer),
+    }
+    if body.generate_turns:
+        calls["turns"] = anthropic.generate_turns(body.prompt, language=body.language)
+    results = await asyncio.gather(*calls.values(), return_exceptions=True)
+    res = {
+        name: f"Error: {result}" if isinstance(result, Exception) else result
+        for name, result in zip(calls, results)
+    }
+    logger.info("full_comparison", extra={"data": {"response": res}})
     return res
 
 @router.post("/comparison/reevaluate")
 async def reevaluate(body: ReEvaluateResponsesRequest):
-    res = anthropic.reevaluate_responses(
+    res = await anthropic.reevaluate_responses(
         body.prompt,
         body.model_a,
         body.model_b,
@@ -80,11 +174,40 @@ async def reevaluate(body: ReEvaluateResponsesRequest):
         body.requested_changes,
         body.language,
     )
-    print(res)
+    logger.info("reevaluate_responses", extra={"data": {"response": res}})
     return res
 
 @router.post("/comparison/generate-test-code")
-async def generate_test_code(body: GenerateTestCodeRequest):
-    res = anthropic.generate_test_code(body.prompt, body.answer)
-    print(res)
+async def generate_test_code(body: GenerateTestCodeRequest, background: bool = False):
+    if background:
+        return submit_job(
+            "generate_test_code",
+            lambda: anthropic.generate_test_code(body.prompt, body.answer, priority=Priority.BULK),
+        )
+    res = await anthropic.generate_test_code(body.prompt, body.answer)
+    logger.info("generate_test_code", extra={"data": {"response": res}})
     return res
+
+@router.post("/comparison/generate-test-code/stream")
+async def generate_test_code_stream(body: GenerateTestCodeRequest):
+    """
+    Generate the test code, streaming the tokens and each completed code block as server-sent events
+    """
+    events = anthropic.stream_generate_test_code(body.prompt, body.answer)
+    return StreamingResponse(to_sse(events), media_type="text/event-stream")
+
+
+@router.get("/usage")
+async def usage():
+    """
+    Token usage per operation, including the prompt cache reads and writes
+    """
+    return anthropic.usage
+
+
+@router.get("/rate-limits")
+async def rate_limits():
+    """
+    Requests in flight and queued, and the remaining rate limit budget per provider and model
+    """
+    return scheduler.stats()
@@ -1,7 +1,24 @@
-from nbformat.notebooknode import NotebookNode
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections.abc import AsyncIterator, Iterable
+from concurrent.futures import ProcessPoolExecutor
 
-from app.models import Block, BlockType, StructureError
+from nbformat.v4 import new_markdown_cell
+
+from app.models import Block, BlockType, ParsedNotebook, StructureError
+from app.utils.cache import LRUCache
 from app.utils.regex import is_snake_case
+from app.utils.services import load_colab_file
+
+
+_review_pool: ProcessPoolExecutor | None = None
+# Whole file results keyed by the hash of the notebook bytes, and per-cell results keyed by the hash
+# of the cell source, so editing a single cell only re-checks that cell
+_review_cache = LRUCache(int(os.getenv("REVIEW_CACHE_SIZE", 128)))
+_cell_review_cache = LRUCache(int(os.getenv("REVIEW_CELL_CACHE_SIZE", 4096)))
 
 
 class Rule:
@@ -16,6 +33,9 @@ class Rule:
         self.allow_startswith = allow_startswith
 
 
+TEST_BLOCK_TYPES = (BlockType.PYTHON_TEST, BlockType.SWIFT_TEST)
+
+
 class Section:
     PROMPT = "# Prompt:"
     EXAMPLES = "**Example:**-"
@@ -28,38 +48,51 @@ class Section:
         return [Section.PROMPT, Section.EXAMPLES, Section.STARTER_CODE, Section.PYTHON_CODE, Section.SWIFT_CODE]
 
 
-def check_for_snake_case_functions(colab_file: NotebookNode) -> list[StructureError]:
+def _check_snake_case_block(block: Block, lines: list[str]) -> list[StructureError]:
+    """
+    Check if the functions of a single block are in snake_case
+
+    :param block: The block to be checked
+    :param lines: The lines of the block
+    :return: A list of errors if the block has functions not in snake_case
+    """
+    errors = []
+    for index, line in enumerate(lines):
+        if "def " in line:
+            function_name = line.split("def ")[1].split("(")[0]
+            if not is_snake_case(function_name):
+                errors.append(
+                    StructureError(
+                        block=block,
+                        line_number=index,
+                        line_text=line,
+                        error_message="Function names should be in snake_case",
+                    )
+                )
+    return errors
+
+
+def check_for_snake_case_functions(notebook: ParsedNotebook) -> list[StructureError]:
     """
     Check if the Google Colab file has functions in snake_case
 
-    :param colab_file: The Google Colab file to be checked
+    :param notebook: The parsed Google Colab file to be checked
     :return: A list of errors if the file has functions not in snake_case
     """
     errors = []
-    blocks = [Block(cell) for cell in colab_file.cells]
-    for block in blocks:
-        lines = block.content.split("\n")
-        for index, line in enumerate(lines):
-            if "def " in line:
-                function_name = line.split("def ")[1].split("(")[0]
-                if not is_snake_case(function_name):
-                    errors.append(
-                        StructureError(
-                            block=block,
-                            line_number=index,
-                            line_text=line,
-                            error_message="Function names should be in snake_case",
-                        )
-                    )
+    for block, _, lines in notebook:
+        errors.extend(_check_snake_case_block(block, lines))
     return errors
 
 
-def check_for_test_cases(colab_file: NotebookNode) -> list[StructureError]:
+def _check_test_cases_block(block: Block, block_type: str, lines: list[str]) -> list[StructureError]:
     """
-    Check if the Google Colab file has the correct test cases structure
+    Check if a single test block has the correct test cases structure
 
-    :param colab_file: The Google Colab file to be checked
-    :return: A list of errors if the file does not have the correct test cases structure
+    :param block: The test block to be checked
+    :param block_type: The type of the block
+    :param lines: The lines of the block
+    :return: A list of errors if the block does not have the correct test cases structure
     """
     def get_top_comment() -> str:
         output = lines[index - 1]
@@ -74,66 +107,89 @@ def check_for_test_cases(colab_file: NotebookNode) -> list[StructureError]:
         return output
 
     errors = []
-    blocks = [Block(cell) for cell in colab_file.cells]
-    test_blocks = [block for block in blocks if block.type in [BlockType.PYTHON_TEST, BlockType.SWIFT_TEST]]
-
-    if not test_blocks:
-        return [
-            StructureError(
-                block=blocks[0],
-                line_number=0,
-                line_text="",
-                error_message="There are no test cases in the file",
-            )
-        ]
-
-    for block in test_blocks:
-        lines = block.content.split("\n")
-        uses_test_framework = lines[0].startswith("import unittest") or lines[0].startswith("import XCTest")
-        current_test = None if uses_test_framework else 0
-        sharp = "#" if block.type == BlockType.PYTHON_TEST else "//"
-        for index, line in enumerate(lines):
-            if uses_test_framework:
-                if line.startswith("class Test"):
-                    current_test = 0
-                elif current_test is not None and ("  def test" in line or "func test" in line):
-                    current_test += 1
-                    comment = get_top_comment()
-                    if f"{sharp} Test Case {current_test}: " not in comment:
-                        errors.append(
-                            StructureError(
-                                block=block,
-                                line_number=index - 1,
-                                line_text=comment,
-                                error_message=f"Expected '{sharp} Test Case {current_test}: ...' before the test case",
-                            )
+    uses_test_framework = lines[0].startswith("import unittest") or lines[0].startswith("import XCTest")
+    current_test = None if uses_test_framework else 0
+    sharp = "#" if block_type == BlockType.PYTHON_TEST else "//"
+    for index, line in enumerate(lines):
+        if uses_test_framework:
+            if line.startswith("class Test"):
+                current_test = 0
+            elif current_test is not None and ("  def test" in line or "func test" in line):
+                current_test += 1
+                comment = get_top_comment()
+                if f"{sharp} Test Case {current_test}: " not in comment:
+                    errors.append(
+                        StructureError(
+                            block=block,
+                            line_number=index - 1,
+                            line_text=comment,
+                            error_message=f"Expected '{sharp} Test Case {current_test}: ...' before the test case",
                         )
-            else:
-                if "assert" in line:
-                    current_test += 1
-                    comment = get_top_comment()
-                    if f"{sharp} Test Case {current_test}: " not in comment:
-                        errors.append(
-                            StructureError(
-                                block=block,
-                                line_number=index - 1,
-                                line_text=comment,
-                                error_message=f"Expected '{sharp} Test Case {current_test}: ...' before the test case",
-                            )
+                    )
+        else:
+            if "assert" in line:
+                current_test += 1
+                comment = get_top_comment()
+                if f"{sharp} Test Case {current_test}: " not in comment:
+                    errors.append(
+                        StructureError(
+                            block=block,
+                            line_number=index - 1,
+                            line_text=comment,
+                            error_message=f"Expected '{sharp} Test Case {current_test}: ...' before the test case",
                         )
+                    )
     return errors
 
 
-def check_prompt_block(colab_file: NotebookNode) -> list[StructureError]:
+def _missing_test_cases_error(block: Block) -> StructureError:
+    return StructureError(
+        block=block,
+        line_number=0,
+        line_text="",
+        error_message="There are no test cases in the file",
+    )
+
+
+def _empty_file_error() -> StructureError:
+    return StructureError(
+        block=Block(new_markdown_cell()),
+        line_number=0,
+        line_text="",
+        error_message="The file is empty",
+    )
+
+
+def check_for_test_cases(notebook: ParsedNotebook) -> list[StructureError]:
     """
-    Check if the Google Colab file has a prompt block
+    Check if the Google Colab file has the correct test cases structure
 
-    :param colab_file: The Google Colab file to be checked
-    :return: A list of errors if the file does not have a prompt block
+    :param notebook: The parsed Google Colab file to be checked
+    :return: A list of errors if the file does not have the correct test cases structure
+    """
+    errors = []
+    has_test_blocks = False
+    for block, block_type, lines in notebook:
+        if block_type in TEST_BLOCK_TYPES:
+            has_test_blocks = True
+            errors.extend(_check_test_cases_block(block, block_type, lines))
+    # An empty file is reported by check_prompt_block
+    if not has_test_blocks and notebook.blocks:
+        return [_missing_test_cases_error(notebook.blocks[0])]
+    return errors
+
+
+def _check_prompt_block(block: Block, block_type: str, lines: list[str]) -> list[StructureError]:
+    """
+    Check if a block follows the prompt block structure
+
+    :param block: The block to be checked, expected to be the first one of the file
+    :param block_type: The type of the block
+    :param lines: The lines of the block
+    :return: A list of errors if the block is not a valid prompt block
     """
 
     errors = []
-    block = Block(colab_file.cells[0])
     rules = [
         Rule(Section.PROMPT),
         Rule(),
@@ -164,8 +220,7 @@ def check_prompt_block(colab_file: NotebookNode) -> list[StructureError]:
         Rule("Explanation: ", True),
         Rule(),
     ]
-    if block.type == BlockType.PROMPT:
-        lines = block.content.split("\n")
+    if block_type == BlockType.PROMPT:
         section = Section.PROMPT
         example_count = 0
         rule_index = 0
@@ -295,3 +350,176 @@ def check_prompt_block(colab_file: NotebookNode) -> list[StructureError]:
             )
         )
     return errors
+
+
+def check_prompt_block(notebook: ParsedNotebook) -> list[StructureError]:
+    """
+    Check if the Google Colab file has a prompt block
+
+    :param notebook: The parsed Google Colab file to be checked
+    :return: A list of errors if the file does not have a prompt block
+    """
+    if not notebook.blocks:
+        return [_empty_file_error()]
+    block = notebook.blocks[0]
+    return _check_prompt_block(block, block.type, block.lines)
+
+
+class _CellReview:
+    __slots__ = ("block", "snake_case_errors", "test_case_errors", "_prompt_errors")
+
+    def __init__(self, block: Block):
+        """
+        The errors of a single block, which only depend on its content
+
+        :param block: The block to be reviewed
+        """
+        self.block = block
+        self.snake_case_errors = _check_snake_case_block(block, block.lines)
+        if block.type in TEST_BLOCK_TYPES:
+            self.test_case_errors = _check_test_cases_block(block, block.type, block.lines)
+        else:
+            self.test_case_errors = None
+        self._prompt_errors = None
+
+    @property
+    def prompt_errors(self) -> list[StructureError]:
+        # Only the first block of a file is checked as the prompt, so it is computed on demand
+        if self._prompt_errors is None:
+            self._prompt_errors = _check_prompt_block(self.block, self.block.type, self.block.lines)
+        return self._prompt_errors
+
+
+def _merge_cell_reviews(reviews: list[_CellReview]) -> dict[str, list[StructureError]]:
+    if not reviews:
+        return {"prompt_errors": [_empty_file_error()], "snake_case_errors": [], "test_case_errors": []}
+    snake_case_errors = []
+    test_case_errors = []
+    has_test_blocks = False
+    for review in reviews:
+        snake_case_errors.extend(review.snake_case_errors)
+        if review.test_case_errors is not None:
+            has_test_blocks = True
+            test_case_errors.extend(review.test_case_errors)
+    if not has_test_blocks:
+        test_case_errors = [_missing_test_cases_error(reviews[0].block)]
+    return {
+        "prompt_errors": reviews[0].prompt_errors,
+        "snake_case_errors": snake_case_errors,
+        "test_case_errors": test_case_errors,
+    }
+
+
+def review_notebook(notebook: ParsedNotebook) -> dict[str, list[StructureError]]:
+    """
+    Run every check over the parsed Google Colab file in a single pass over its blocks
+
+    :param notebook: The parsed Google Colab file to be reviewed
+    :return: A dictionary with the errors of each check
+    """
+    return _merge_cell_reviews([_CellReview(block) for block in notebook.blocks])
+
+
+def review_colab_content(content: bytes) -> dict[str, list[StructureError]]:
+    """
+    Review a Google Colab file from its raw content, reusing the cached results of the same file
+    or of its unchanged cells. The returned lists are shared with the cache and must not be modified
+
+    :param content: The raw content of the file
+    :return: A dictionary with the errors of each check
+    """
+    file_key = hashlib.sha256(content).hexdigest()
+    result = _review_cache.get(file_key)
+    if result is not None:
+        return result
+
+    reviews = []
+    for cell in load_colab_file(content=content).cells:
+        cell_key = hashlib.sha256(f"{cell.cell_type}\0{cell.source}".encode()).hexdigest()
+        review = _cell_review_cache.get(cell_key)
+        if review is None:
+            review = _CellReview(Block(cell))
+            _cell_review_cache.set(cell_key, review)
+        reviews.append(review)
+    result = _merge_cell_reviews(reviews)
+    _review_cache.set(file_key, result)
+    return result
+
+
+def review_notebook_content(file_name: str, content: bytes) -> dict:
+    """
+    Review a Google Colab file from its raw content. Runs in the batch review worker processes,
+    so the result only holds plain data
+
+    :param file_name: The name of the file to be reviewed
+    :param content: The raw content of the file
+    :return: A dictionary with the review result and the time it took
+    """
+    start = time.perf_counter()
+    try:
+        result = {
+            key: [error.model_dump() for error in errors]
+            for key, errors in review_colab_content(content).items()
+        }
+    except Exception as e:
+        result = {"error": f"Error: {e}"}
+    return {
+        "file_name": file_name,
+        **result,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+def get_review_workers() -> int:
+    """
+    Get the amount of batch review worker processes, read from REVIEW_BATCH_WORKERS
+
+    :return: The amount of workers, defaults to the CPU count
+    """
+    workers = os.getenv("REVIEW_BATCH_WORKERS")
+    return int(workers) if workers else os.cpu_count() or 1
+
+
+def get_review_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool shared by the batch reviews, creating it on first use
+
+    :return: The process pool
+    """
+    global _review_pool
+    if _review_pool is None:
+        _review_pool = ProcessPoolExecutor(max_workers=get_review_workers())
+    return _review_pool
+
+
+async def stream_review_results(notebooks: Iterable[tuple[str, bytes]]) -> AsyncIterator[str]:
+    """
+    Review the Google Colab files in the process pool and yield each result as a JSON line as soon
+    as it is ready. Only a couple of files per worker are in flight at once, so the memory used
+    does not depend on the size of the batch
+
+    :param notebooks: The (file name, raw content) tuples to be reviewed
+    :return: An async iterator of newline-delimited JSON results
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_review_pool()
+    max_pending = get_review_workers() * 2
+    pending = set()
+    iterator = iter(notebooks)
+    while True:
+        try:
+            file_name, content = next(iterator)
+        except StopIteration:
+            break
+        except ValueError as e:
+            yield json.dumps({"error": f"Error: {e}"}) + "\n"
+            break
+        pending.add(loop.run_in_executor(pool, review_notebook_content, file_name, content))
+        if len(pending) >= max_pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result()) + "\n"
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield json.dumps(task.result()) + "\n"
@@ -0,0 +1,36 @@
+import json
+import os
+from typing import Any
+
+
+def read_json_file(path: str | None, default: Any = None) -> Any:
+    """
+    Read a JSON file written by write_json_file
+
+    :param path: The path of the file. If None, the default is returned
+    :param default: The value returned when the file does not exist or is not valid JSON
+    :return: The parsed content or the default
+    """
+    if not path or not os.path.exists(path):
+        return default
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_file(path: str, data: Any) -> None:
+    """
+    Write a JSON file through a temporary file, so a crash while writing does not leave it
+    truncated
+
+    :param path: The path of the file. Its folder is created if needed
+    :param data: The JSON serializable content
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
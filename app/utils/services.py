@@ -1,12 +1,16 @@
 import nbformat
 import shutil
+import tempfile
+import zipfile
+from collections.abc import Iterator
 from fastapi import UploadFile
 from nbformat.notebooknode import NotebookNode
 
 
-def is_python_code(cell: NotebookNode) -> bool:
+def is_python_code(cell: NotebookNode, lines: list[str] = None) -> bool:
     if cell.cell_type == "code":
-        lines = cell.source.split("\n")
+        if lines is None:
+            lines = cell.source.split("\n")
         if "def " in cell.source:
             def_lines = [line for line in lines if "def " in line]
             for line in def_lines:
@@ -24,9 +28,10 @@ def is_python_code(cell: NotebookNode) -> bool:
     return False
 
 
-def is_swift_code(cell: NotebookNode) -> bool:
+def is_swift_code(cell: NotebookNode, lines: list[str] = None) -> bool:
     if cell.cell_type == "code":
-        lines = cell.source.split("\n")
+        if lines is None:
+            lines = cell.source.split("\n")
         if "func " in cell.source:
             func_lines = [line for line in lines if "func " in line]
             for line in func_lines:
@@ -42,15 +47,18 @@ def is_swift_code(cell: NotebookNode) -> bool:
     return False
 
 
-def load_colab_file(file_path: str = None, file: UploadFile = None) -> NotebookNode:
+def load_colab_file(file_path: str = None, file: UploadFile = None, content: bytes = None) -> NotebookNode:
     """
     Load a Google Colab file
 
     :param file_path: The path of the file to be loaded
     :param file: The file to be loaded
+    :param content: The raw content of the file to be loaded
     :return: The content of the file
     """
-    if file:
+    if content is not None:
+        return nbformat.reads(content.decode("utf-8"), as_version=4)
+    elif file:
         return nbformat.read(file.file, as_version=4)
     elif file_path:
         with open(file_path, "r") as file:
@@ -59,6 +67,45 @@ def load_colab_file(file_path: str = None, file: UploadFile = None) -> NotebookN
         raise ValueError("Either file_path or file must be provided")
 
 
+def iter_colab_files(files: list[UploadFile]) -> Iterator[tuple[str, bytes]]:
+    """
+    Iterate over the Google Colab files of an upload, extracting the ones inside zip archives.
+    The files are read one at a time, so only the current one is held in memory
+
+    :param files: The uploaded .ipynb files or zip archives
+    :return: An iterator of (file name, raw content) tuples
+    """
+    for file in files:
+        if file.filename.endswith(".ipynb"):
+            yield file.filename, file.file.read()
+        elif file.filename.endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile:
+                raise ValueError(f"Invalid zip archive: {file.filename}")
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.endswith(".ipynb") or info.filename.startswith("__MACOSX/"):
+                        continue
+                    yield info.filename, archive.read(info)
+        else:
+            raise ValueError(f"Invalid file format: {file.filename}")
+
+
+def detach_upload(file: UploadFile) -> UploadFile:
+    """
+    Copy an uploaded file to a temporary file that outlives the request, so it can still be read
+    once the response has started. The copy is done in chunks and the caller must close it
+
+    :param file: The uploaded file
+    :return: A new upload backed by the temporary file
+    """
+    buffer = tempfile.TemporaryFile()
+    shutil.copyfileobj(file.file, buffer)
+    buffer.seek(0)
+    return UploadFile(file=buffer, filename=file.filename)
+
+
 def save_to_files(file: UploadFile, path: str = None) -> None:
     """
     Save the file to the specified path
@@ -0,0 +1,247 @@
+"""
+Benchmarks of the notebook review checks on generated notebooks.
+
+    python -m benchmarks.bench_review                  # Compare against benchmarks/baseline.json
+    python -m benchmarks.bench_review --save           # Store the results as the new baseline
+    python -m benchmarks.bench_review --only large     # Run the scenarios whose name contains "large"
+
+The min times are divided by a fixed calibration loop measured next to each benchmark, so a baseline
+stored on one machine can be compared on another. The exit code is 1 if any benchmark is slower than the
+baseline by more than the tolerance. A baseline of another Python minor version is not compared.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+
+import nbformat
+
+from app.models import ParsedNotebook
+from app.services import (
+    _cell_review_cache,
+    _review_cache,
+    check_for_snake_case_functions,
+    check_for_test_cases,
+    check_prompt_block,
+    review_colab_content,
+    review_notebook,
+)
+from benchmarks.notebooks import generate_notebook
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# name: arguments of generate_notebook
+SCENARIOS = {
+    "small": dict(cells=5, cell_lines=10, tests=5, error_rate=0.0),
+    "medium": dict(cells=20, cell_lines=40, tests=10, error_rate=0.1),
+    "large": dict(cells=100, cell_lines=80, tests=20, error_rate=0.1),
+    "long_cells": dict(cells=10, cell_lines=2000, tests=200, error_rate=0.1, examples=50),
+    "error_dense": dict(cells=40, cell_lines=40, tests=20, error_rate=0.9, examples=10),
+}
+
+
+def _calibrate() -> float:
+    # A fixed pure Python workload, so the results are relative to the speed of the machine. It is
+    # measured next to every benchmark, since the speed of shared machines drifts during a run
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        total = 0
+        for index in range(100_000):
+            total += len(str(index).split("1"))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _time(func: Callable[[], object], number: int, setup: Callable[[], None] | None) -> float:
+    total = 0.0
+    for _ in range(number):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        total += time.perf_counter() - start
+    return total
+
+
+def _measure(func: Callable[[], object], repeat: int, setup: Callable[[], None] | None = None) -> dict:
+    """
+    Time a function and measure the peak memory it allocates. Like timeit, each run calls the
+    function enough times to take at least 20 ms, with the garbage collector disabled
+
+    :param func: The function to benchmark
+    :param repeat: The amount of timed runs
+    :param setup: Called before every call, outside of the timing
+    :return: The median, min and max seconds per call and the peak allocated bytes
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        number = 1
+        while (elapsed := _time(func, number, setup)) < 0.02:
+            number = max(number * 2, int(number * 0.025 / max(elapsed, 1e-9)))
+        times = [_time(func, number, setup) / number for _ in range(repeat)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median_s": statistics.median(times), "min_s": min(times), "max_s": max(times), "peak_bytes": peak}
+
+
+def _clear_caches() -> None:
+    _review_cache.clear()
+    _cell_review_cache.clear()
+
+
+def _run_one(func: Callable[[], object], repeat: int, setup: Callable[[], None] | None) -> dict:
+    calibration = _calibrate()
+    result = _measure(func, repeat, setup)
+    result["calibration_s"] = min(calibration, _calibrate())
+    # The min is the least affected by other processes, so it is the one compared
+    result["relative"] = result["min_s"] / result["calibration_s"]
+    return result
+
+
+def run(
+    only: str | None = None, repeat: int = 5, baseline: dict | None = None, tolerance: float = 0.25, retries: int = 2
+) -> dict:
+    """
+    Run every benchmark of the selected scenarios. A benchmark slower than the baseline is run
+    again, keeping its best result, so a noisy moment of the machine is not reported as a regression
+
+    :param only: Only run the scenarios whose name contains this text
+    :param repeat: The amount of timed runs of each benchmark
+    :param baseline: The stored report to compare against
+    :param tolerance: The allowed slowdown, e.g. 0.25 for 25%
+    :param retries: The max amount of times a slower benchmark is run again
+    :return: The report, with the calibration time and the results keyed by "scenario/benchmark"
+    """
+    calibrations = []
+    results = {}
+    for scenario, arguments in SCENARIOS.items():
+        if only and only not in scenario:
+            continue
+        notebook = generate_notebook(**arguments)
+        content = nbformat.writes(notebook).encode()
+        parsed = ParsedNotebook(notebook)
+        benchmarks = {
+            "parse": (lambda: ParsedNotebook(notebook), None),
+            "check_prompt_block": (lambda: check_prompt_block(parsed), None),
+            "check_for_snake_case_functions": (lambda: check_for_snake_case_functions(parsed), None),
+            "check_for_test_cases": (lambda: check_for_test_cases(parsed), None),
+            "review_notebook": (lambda: review_notebook(parsed), None),
+            "review_colab_content_cold": (lambda: review_colab_content(content), _clear_caches),
+            "review_colab_content_cached": (lambda: review_colab_content(content), None),
+        }
+        for name, (func, setup) in benchmarks.items():
+            key = f"{scenario}/{name}"
+            result = _run_one(func, repeat, setup)
+            previous = (baseline or {}).get("results", {}).get(key)
+            for _ in range(retries if previous else 0):
+                if result["relative"] <= previous["relative"] * (1 + tolerance):
+                    break
+                result = min(result, _run_one(func, repeat, setup), key=lambda item: item["relative"])
+            calibrations.append(result["calibration_s"])
+            results[key] = result
+        results[f"{scenario}/review_notebook"]["errors"] = sum(len(errors) for errors in review_notebook(parsed).values())
+        results[f"{scenario}/review_notebook"]["size_bytes"] = len(content)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "calibration_s": statistics.median(calibrations) if calibrations else None,
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Find the benchmarks slower than the baseline, comparing the times relative to the calibration
+
+    :param report: The current report
+    :param baseline: The stored report
+    :param tolerance: The allowed slowdown, e.g. 0.25 for 25%
+    :return: The description of each regression
+    """
+    regressions = []
+    for key, result in report["results"].items():
+        previous = baseline["results"].get(key)
+        if previous is None:
+            continue
+        ratio = result["relative"] / previous["relative"]
+        if ratio > 1 + tolerance:
+            regressions.append(f"{key}: {ratio:.2f}x slower than the baseline")
+        if "errors" in previous and result.get("errors") != previous["errors"]:
+            regressions.append(f"{key}: {result.get('errors')} errors, the baseline found {previous['errors']}")
+    return regressions
+
+
+def _print_report(report: dict, baseline: dict | None) -> None:
+    print(f"Python {report['python']} ({report['machine']}), calibration {report['calibration_s'] * 1000:.1f} ms")
+    print(f"{'benchmark':<55} {'median':>10} {'min':>10} {'peak mem':>10} {'vs base':>8}")
+    for key, result in report["results"].items():
+        previous = baseline["results"].get(key) if baseline else None
+        change = f"{result['relative'] / previous['relative']:.2f}x" if previous else "-"
+        print(
+            f"{key:<55} {result['median_s'] * 1000:>8.3f}ms {result['min_s'] * 1000:>8.3f}ms "
+            f"{result['peak_bytes'] / 1024:>8.1f}KB {change:>8}"
+        )
+
+
+def _minor_version(version: str) -> str:
+    return ".".join(version.split(".")[:2])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the notebook review checks")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="The baseline report to compare against")
+    parser.add_argument("--save", action="store_true", help="Store the results as the baseline")
+    parser.add_argument("--only", help="Only run the scenarios whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5, help="The amount of timed runs of each benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="The allowed slowdown, e.g. 0.25 for 25%%")
+    parser.add_argument("--retries", type=int, default=2, help="The max amount of times a slower benchmark is run again")
+    parser.add_argument("--output", help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    baseline = None
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        # The calibration loop does not cancel out the differences between interpreter versions
+        if _minor_version(baseline["python"]) != _minor_version(platform.python_version()):
+            print(
+                f"WARNING The baseline was recorded on Python {baseline['python']}, so it is not compared. "
+                f"Run with Python {_minor_version(baseline['python'])} or store a new baseline with --save"
+            )
+            baseline = None
+    report = run(args.only, args.repeat, baseline, args.tolerance, args.retries)
+    _print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.save:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
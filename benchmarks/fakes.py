@@ -0,0 +1,275 @@
+"""
+Fake Anthropic, OpenAI and Google Drive backends for load tests, with configurable latency and
+error rates. They are injected into the app by install_fakes, so no tokens are spent and Drive is
+never touched.
+"""
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+
+
+class Latency:
+    def __init__(self, median: float, p99: float | None = None):
+        """
+        Log-normal latency, which like real services has a long tail
+
+        :param median: The median seconds
+        :param p99: The 99th percentile seconds. Defaults to 3 times the median
+        """
+        self.median = median
+        self.p99 = p99 if p99 is not None else median * 3
+        self._mu = math.log(median) if median > 0 else 0
+        # 2.326 is the z-score of the 99th percentile
+        self._sigma = math.log(self.p99 / median) / 2.326 if median > 0 and self.p99 > median else 0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return rng.lognormvariate(self._mu, self._sigma)
+
+
+COMPARISON = {
+    "model_a": {"overall_satisfaction": {"score": "Pretty good", "comment": "Fake comparison"}},
+    "model_b": {"overall_satisfaction": {"score": "Pretty good", "comment": "Fake comparison"}},
+    "comparison": {"score": "Model A and Model B are equally good", "comment": "Fake comparison"},
+}
+TRANSLATION = {"code": "def solve(nums: list) -> int:\n    return sum(nums)\n"}
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class FakeLLMTransport(httpx.AsyncBaseTransport):
+    def __init__(self, latency: Latency, error_rate: float = 0.0, seed: int = 0, chunks: int = 20):
+        """
+        httpx transport that answers the Anthropic Messages and OpenAI Chat Completions APIs.
+        Failed requests are answered with 429 (with retry-after and rate limit headers), 529 or 500
+
+        :param latency: The latency of each response. Streams send the first event after it
+        :param error_rate: The probability of a request failing
+        :param seed: The seed of the random generator
+        :param chunks: The amount of text events of a streamed response
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        body = json.loads(request.content)
+        await asyncio.sleep(self.latency.sample(self.rng))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return self._error(request)
+        if request.url.path.endswith("/chat/completions"):
+            text = json.dumps(TRANSLATION)
+            return httpx.Response(200, json={
+                "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 1000, "completion_tokens": 200, "total_tokens": 1200},
+            })
+        text = json.dumps(COMPARISON)
+        usage = {"input_tokens": 1000, "output_tokens": 200, "cache_read_input_tokens": 4000, "cache_creation_input_tokens": 0}
+        if body.get("stream"):
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=self._stream(text, body, usage))
+        return httpx.Response(200, json={
+            "id": "fake", "type": "message", "role": "assistant", "model": body["model"],
+            "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None, "usage": usage,
+        })
+
+    def _error(self, request: httpx.Request) -> httpx.Response:
+        status = self.rng.choice((429, 529, 500))
+        headers = {"retry-after": "1"} if status == 429 else {}
+        if status == 429 and "anthropic" in request.url.host:
+            headers["anthropic-ratelimit-requests-remaining"] = "0"
+            headers["anthropic-ratelimit-requests-reset"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 1))
+        return httpx.Response(status, headers=headers, json={"type": "error", "error": {"type": "fake_error", "message": "Fake error"}})
+
+    def _stream(self, text: str, body: dict, usage: dict) -> httpx.AsyncByteStream:
+        chunk_size = max(len(text) // self.chunks, 1)
+        latency = self.latency
+        rng = self.rng
+
+        class Stream(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                message = {"id": "fake", "type": "message", "role": "assistant", "model": body["model"], "content": [],
+                           "stop_reason": None, "stop_sequence": None, "usage": {**usage, "output_tokens": 1}}
+                yield _sse("message_start", {"type": "message_start", "message": message}).encode()
+                yield _sse("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}).encode()
+                for index in range(0, len(text), chunk_size):
+                    # The rest of the response takes about as long as the first token
+                    await asyncio.sleep(latency.sample(rng) / (len(text) / chunk_size))
+                    delta = {"type": "text_delta", "text": text[index:index + chunk_size]}
+                    yield _sse("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": delta}).encode()
+                yield _sse("content_block_stop", {"type": "content_block_stop", "index": 0}).encode()
+                yield _sse("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                             "usage": {"output_tokens": usage["output_tokens"]}}).encode()
+                yield _sse("message_stop", {"type": "message_stop"}).encode()
+
+        return Stream()
+
+
+class FakeDrive:
+    def __init__(self, latency: Latency, error_rate: float = 0.0, seed: int = 0):
+        """
+        In-memory stand-in of the Drive v3 resource built by googleapiclient. The requests block
+        for the latency, like the real client does in the thread pool, and fail with 503 at the
+        error rate. Failed requests are retried num_retries times like HttpRequest.execute. Files
+        bigger than DRIVE_UPLOAD_CHUNK_SIZE are sent by the resumable upload protocol outside of
+        this resource, so the load test only uploads small screenshots
+
+        :param latency: The latency of each request or batch
+        :param error_rate: The probability of a request failing
+        :param seed: The seed of the random generator
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._files: dict[tuple[str | None, str], str] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def files(self) -> "FakeDrive":
+        return self
+
+    def list(self, q: str, **kwargs) -> "FakeDriveRequest":
+        return FakeDriveRequest(self, "drive.files.list", lambda: self._list(q))
+
+    def create(self, body: dict, **kwargs) -> "FakeDriveRequest":
+        return FakeDriveRequest(self, "drive.files.create", lambda: self._create(body))
+
+    def copy(self, fileId: str, body: dict, **kwargs) -> "FakeDriveRequest":
+        return FakeDriveRequest(self, "drive.files.copy", lambda: self._create(body))
+
+    def get(self, fileId: str, **kwargs) -> "FakeDriveRequest":
+        return FakeDriveRequest(self, "drive.files.get", lambda: self._get(fileId))
+
+    def new_batch_http_request(self, callback) -> "FakeDriveBatch":
+        return FakeDriveBatch(self, callback)
+
+    def _wait(self) -> bool:
+        """
+        Block for the latency of a request
+
+        :return: If the request failed
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency.sample(self.rng)
+            failed = self.rng.random() < self.error_rate
+            self.errors += failed
+        time.sleep(delay)
+        return failed
+
+    def _list(self, query: str) -> dict:
+        parent = query.split("'")[1]
+        with self._lock:
+            if "name='" in query:
+                name = query.split("name='")[1].rstrip("'")
+                file_id = self._files.get((parent, name))
+                return {"files": [{"id": file_id, "name": name}] if file_id else []}
+            return {"files": [{"id": file_id, "name": name} for (folder, name), file_id in self._files.items() if folder == parent]}
+
+    def _get(self, file_id: str) -> dict:
+        with self._lock:
+            if file_id not in self._files.values():
+                raise HttpError(httplib2.Response({"status": 404}), b'{"error": {"message": "File not found"}}')
+        return {"id": file_id, "trashed": False}
+
+    def _create(self, body: dict) -> dict:
+        with self._lock:
+            file_id = f"fake{next(self._ids)}"
+            self._files[((body.get("parents") or [None])[0], body["name"])] = file_id
+        return {"id": file_id}
+
+
+class FakeDriveRequest:
+    def __init__(self, drive: FakeDrive, method_id: str, run):
+        self.drive = drive
+        self.methodId = method_id
+        self._run = run
+
+    def execute(self, http=None, num_retries: int = 0) -> dict:
+        for attempt in range(num_retries + 1):
+            if not self.drive._wait():
+                return self._run()
+            if attempt < num_retries:
+                time.sleep(min(2 ** attempt * self.drive.rng.random(), 1))
+        raise HttpError(httplib2.Response({"status": 503}), b'{"error": {"message": "Fake error"}}')
+
+
+class FakeDriveBatch:
+    def __init__(self, drive: FakeDrive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests: list[tuple[str, FakeDriveRequest]] = []
+
+    def add(self, request: FakeDriveRequest, request_id: str) -> None:
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None) -> None:
+        if self.drive._wait():
+            raise HttpError(httplib2.Response({"status": 503}), b'{"error": {"message": "Fake error"}}')
+        for request_id, request in self.requests:
+            with self.drive._lock:
+                failed = self.drive.rng.random() < self.drive.error_rate
+            if failed:
+                self.callback(request_id, None, HttpError(httplib2.Response({"status": 503}), b""))
+            else:
+                self.callback(request_id, request._run(), None)
+
+
+def install_fakes(
+    llm_latency: Latency, llm_error_rate: float, drive_latency: Latency, drive_error_rate: float, seed: int = 0
+):
+    """
+    Import the app with the fake backends in place of the Anthropic, OpenAI and Drive clients
+
+    :param llm_latency: The latency of the LLM responses
+    :param llm_error_rate: The probability of a LLM request failing
+    :param drive_latency: The latency of the Drive requests
+    :param drive_error_rate: The probability of a Drive request failing
+    :param seed: The seed of the random generators
+    :return: The app and the fake backends
+    """
+    import anthropic
+    import openai
+    from google.auth.credentials import AnonymousCredentials
+    from google.oauth2 import service_account
+
+    # The services build their clients when the routers are imported. They are replaced below, but
+    # the keys must be set and the Drive service loads serviceAccount.json
+    os.environ.setdefault("ANTHROPIC_API_KEY", "fake")
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    service_account.Credentials.from_service_account_file = lambda *args, **kwargs: AnonymousCredentials()
+
+    from app.main import app
+    from app.routers import google_drive, llm
+
+    llm_transport = FakeLLMTransport(llm_latency, llm_error_rate, seed)
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+    llm.anthropic.client = anthropic.AsyncAnthropic(
+        api_key="fake", max_retries=0, http_client=httpx.AsyncClient(transport=llm_transport, limits=limits)
+    )
+    llm.openai.client = openai.AsyncOpenAI(
+        api_key="fake", max_retries=0, http_client=httpx.AsyncClient(transport=llm_transport, limits=limits)
+    )
+    drive = FakeDrive(drive_latency, drive_error_rate, seed)
+    google_drive.gdrive.drive = drive
+    google_drive.gdrive.parent_folder_id = "root"
+    return app, llm_transport, drive
@@ -0,0 +1,311 @@
+"""
+Offline load test of the /llm and /gdrive endpoints, with fake Anthropic, OpenAI and Drive backends.
+
+    python -m benchmarks.load_test                                 # Every endpoint, 10 s each at 20 clients
+    python -m benchmarks.load_test --only compare --concurrency 100
+    python -m benchmarks.load_test --llm-latency 2 --llm-p99 10 --llm-error-rate 0.05
+
+The app runs in uvicorn on a background thread and is called over HTTP, so the numbers include the
+server. Each endpoint is loaded in turn for the duration, and the report has its throughput, latency
+percentiles and the lag of the event loop of the app during that phase.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+
+import httpx
+
+from benchmarks.fakes import Latency, install_fakes
+
+
+# A 1x1 PNG, sent as a data URL like the extension does
+PNG = "data:image/png;base64," + base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000005000173a1a8d10000000049454e44ae426082"
+)).decode()
+
+COMPARISON = {
+    "prompt": "Write a function that returns the sum of a list",
+    "model_a": "def sum_list(nums):\n    return sum(nums)",
+    "model_b": "def sum_list(nums):\n    total = 0\n    for num in nums:\n        total += num\n    return total",
+    "output": None,
+    "language": "python",
+}
+
+# name: (path, function of the request number returning the JSON body or None for no body)
+ENDPOINTS: dict[str, tuple[Callable[[int], str], Callable[[int], dict | None]]] = {
+    # The prompts vary, so the LLM response cache does not answer them
+    "compare": (lambda n: "/llm/comparison/compare", lambda n: {**COMPARISON, "prompt": f"{COMPARISON['prompt']} {n}"}),
+    "compare_stream": (
+        lambda n: "/llm/comparison/compare/stream", lambda n: {**COMPARISON, "prompt": f"{COMPARISON['prompt']} {n}"}
+    ),
+    "full_comparison": (
+        lambda n: "/llm/comparison/full",
+        lambda n: {**COMPARISON, "prompt": f"{COMPARISON['prompt']} {n}", "answer": COMPARISON["model_a"]},
+    ),
+    "generate_test_code": (
+        lambda n: "/llm/comparison/generate-test-code",
+        lambda n: {"prompt": f"{COMPARISON['prompt']} {n}", "answer": COMPARISON["model_a"]},
+    ),
+    "translate": (
+        lambda n: "/llm/translation/translate",
+        lambda n: {"code": f"func sumList(nums: [Int]) -> Int {{\n    return nums.reduce({n}, +)\n}}"},
+    ),
+    "create_folders": (lambda n: f"/gdrive/create-folders?task_id=load-{n}", lambda n: None),
+    "upload_screenshots": (
+        lambda n: "/gdrive/upload-screenshots",
+        lambda n: {
+            "task_id": f"load-{n % 20}",
+            "images": [{"turn": turn, "model": model, "image": PNG} for turn in (1, 2) for model in ("a", "b")],
+        },
+    ),
+}
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class _Server:
+    def __init__(self, app, lag_interval: float):
+        """
+        Run the app in uvicorn on a thread with its own event loop, and measure how late a task
+        scheduled on that loop every interval wakes up
+
+        :param app: The ASGI app
+        :param lag_interval: Seconds between the lag samples
+        """
+        import uvicorn
+
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{self.sock.getsockname()[1]}"
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False, lifespan="off"))
+        self.lag_interval = lag_interval
+        self.lags: list[float] = []
+        self.thread = threading.Thread(target=asyncio.run, args=(self._serve(),), daemon=True)
+
+    async def _serve(self) -> None:
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await self.server.serve(sockets=[self.sock])
+        finally:
+            monitor.cancel()
+
+    async def _monitor(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.lags.append(max(loop.time() - expected, 0))
+
+    def start(self) -> None:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(10)
+
+
+async def _load(
+    client: httpx.AsyncClient, endpoint: str, concurrency: int, duration: float, max_requests: int | None
+) -> dict:
+    """
+    Call an endpoint from concurrent clients, each sending its next request when the last one ends
+
+    :param client: The HTTP client of the server
+    :param endpoint: The name of the endpoint in ENDPOINTS
+    :param concurrency: The amount of concurrent clients
+    :param duration: The seconds to keep sending requests
+    :param max_requests: Stop after this amount of requests, even if the duration did not pass
+    :return: The latencies of the successful requests, the errors by status and the elapsed seconds
+    """
+    path, body = ENDPOINTS[endpoint]
+    numbers = itertools.count()
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def worker() -> None:
+        while time.perf_counter() < deadline:
+            number = next(numbers)
+            if max_requests is not None and number >= max_requests:
+                return
+            request_started = time.perf_counter()
+            try:
+                # Streamed responses are read to the end, so the latency is the whole response
+                response = await client.post(path(number), json=body(number))
+                error = None if response.is_success else str(response.status_code)
+            except httpx.HTTPError as e:
+                error = type(e).__name__
+            if error is None:
+                latencies.append(time.perf_counter() - request_started)
+            else:
+                errors[error] = errors.get(error, 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"latencies": latencies, "errors": errors, "elapsed_s": time.perf_counter() - started}
+
+
+def _summary(result: dict, lags: list[float]) -> dict:
+    latencies = result["latencies"]
+    errors = sum(result["errors"].values())
+    return {
+        "requests": len(latencies) + errors,
+        "errors": result["errors"],
+        "rps": len(latencies) / result["elapsed_s"],
+        "latency_s": {
+            "mean": statistics.fmean(latencies) if latencies else 0.0,
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "loop_lag_s": {"p50": _percentile(lags, 50), "p99": _percentile(lags, 99), "max": max(lags, default=0.0)},
+    }
+
+
+def run(
+    endpoints: list[str],
+    concurrency: int = 20,
+    duration: float = 10,
+    max_requests: int | None = None,
+    llm_latency: Latency = Latency(1, 4),
+    llm_error_rate: float = 0.0,
+    drive_latency: Latency = Latency(0.2, 1),
+    drive_error_rate: float = 0.0,
+    seed: int = 0,
+) -> dict:
+    """
+    Start the app with the fake backends and load each endpoint in turn
+
+    :param endpoints: The names of the endpoints in ENDPOINTS
+    :param concurrency: The amount of concurrent clients
+    :param duration: The seconds each endpoint is loaded
+    :param max_requests: The max amount of requests to each endpoint
+    :param llm_latency: The latency of the fake LLM responses
+    :param llm_error_rate: The probability of a fake LLM request failing
+    :param drive_latency: The latency of the fake Drive requests
+    :param drive_error_rate: The probability of a fake Drive request failing
+    :param seed: The seed of the random generators of the fakes
+    :return: The report, with the settings and the summary of each endpoint
+    """
+    # The response cache would answer repeated requests, and the Drive folder cache and the
+    # screenshots are written to the working directory
+    os.environ["LLM_CACHE_URL"] = ""
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.chdir(tempfile.mkdtemp(prefix="load_test_"))
+    app, llm_transport, drive = install_fakes(llm_latency, llm_error_rate, drive_latency, drive_error_rate, seed)
+
+    server = _Server(app, lag_interval=0.01)
+    server.start()
+    results = {}
+
+    async def main() -> None:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=server.url, limits=limits, timeout=300) as client:
+            for endpoint in endpoints:
+                server.lags.clear()
+                result = await _load(client, endpoint, concurrency, duration, max_requests)
+                results[endpoint] = _summary(result, list(server.lags))
+                print(_format_row(endpoint, results[endpoint]), flush=True)
+
+    try:
+        print(_HEADER)
+        asyncio.run(main())
+    finally:
+        server.stop()
+    return {
+        "settings": {
+            "concurrency": concurrency,
+            "duration_s": duration,
+            "llm_latency_s": {"median": llm_latency.median, "p99": llm_latency.p99},
+            "llm_error_rate": llm_error_rate,
+            "drive_latency_s": {"median": drive_latency.median, "p99": drive_latency.p99},
+            "drive_error_rate": drive_error_rate,
+        },
+        "backends": {
+            "llm": {"requests": llm_transport.requests, "errors": llm_transport.errors},
+            "drive": {"requests": drive.requests, "errors": drive.errors},
+        },
+        "results": results,
+    }
+
+
+_HEADER = (
+    f"{'endpoint':<20} {'requests':>8} {'errors':>6} {'rps':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} "
+    f"{'lag p50':>8} {'lag p99':>8} {'lag max':>8}"
+)
+
+
+def _format_row(endpoint: str, summary: dict) -> str:
+    latency = summary["latency_s"]
+    lag = summary["loop_lag_s"]
+    return (
+        f"{endpoint:<20} {summary['requests']:>8} {sum(summary['errors'].values()):>6} {summary['rps']:>8.1f} "
+        + " ".join(f"{latency[key] * 1000:>6.0f}ms" for key in ("p50", "p90", "p99", "max"))
+        + " "
+        + " ".join(f"{lag[key] * 1000:>6.1f}ms" for key in ("p50", "p99", "max"))
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the API with fake LLM and Drive backends")
+    parser.add_argument("--only", help="Only load the endpoints whose name contains this text")
+    parser.add_argument("--concurrency", type=int, default=20, help="The amount of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="The seconds each endpoint is loaded")
+    parser.add_argument("--requests", type=int, help="The max amount of requests to each endpoint")
+    parser.add_argument("--llm-latency", type=float, default=1, help="The median seconds of a LLM response")
+    parser.add_argument("--llm-p99", type=float, default=4, help="The 99th percentile seconds of a LLM response")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="The probability of a LLM request failing")
+    parser.add_argument("--drive-latency", type=float, default=0.2, help="The median seconds of a Drive request")
+    parser.add_argument("--drive-p99", type=float, default=1, help="The 99th percentile seconds of a Drive request")
+    parser.add_argument("--drive-error-rate", type=float, default=0.0, help="The probability of a Drive request failing")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the random generators of the fakes")
+    parser.add_argument("--output", help="Also write the report as JSON to this path")
+    args = parser.parse_args()
+
+    endpoints = [name for name in ENDPOINTS if not args.only or args.only in name]
+    if not endpoints:
+        parser.error(f"No endpoint contains {args.only}")
+    output = os.path.abspath(args.output) if args.output else None
+    report = run(
+        endpoints,
+        args.concurrency,
+        args.duration,
+        args.requests,
+        Latency(args.llm_latency, args.llm_p99),
+        args.llm_error_rate,
+        Latency(args.drive_latency, args.drive_p99),
+        args.drive_error_rate,
+        args.seed,
+    )
+    backends = report["backends"]
+    print(
+        f"Fake LLM: {backends['llm']['requests']} requests, {backends['llm']['errors']} errors. "
+        f"Fake Drive: {backends['drive']['requests']} requests, {backends['drive']['errors']} errors"
+    )
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import random
+
+import nbformat
+from nbformat.notebooknode import NotebookNode
+
+
+def _name(rng: random.Random, error: bool) -> str:
+    words = rng.sample(["parse", "count", "merge", "rotate", "find", "order", "split", "sum", "list", "node"], 2)
+    if error:
+        return words[0] + words[1].capitalize()
+    return "_".join(words)
+
+
+def _prompt(rng: random.Random, examples: int, error_rate: float) -> str:
+    lines = [
+        "# Prompt:",
+        "",
+        " ".join(rng.choice(["Given", "a", "list", "of", "numbers", "return", "the", "sum"]) for _ in range(60)),
+        "",
+        "**Keywords:**- lists, sorting",
+        "",
+        "**Difficulty Level:** - Medium",
+        "",
+        "**Example:**-",
+        "",
+    ]
+    for number in range(1, examples + 1):
+        header = f"Example {number}:" if rng.random() >= error_rate else f"Example{number}:"
+        lines += [header, "", "Input: nums = [1, 2, 3]", "", "Output: 6", "", "Explanation: 1 + 2 + 3 = 6", ""]
+        if rng.random() < error_rate:
+            lines.append("")
+    lines += [
+        " **Starter Code:** -",
+        "",
+        "```python",
+        "def sum_list(nums: list) -> int:",
+        "```",
+        "```swift",
+        "func sumList(nums: [Int]) -> Int {",
+        "```",
+    ]
+    return "\n".join(lines)
+
+
+def _python_code(rng: random.Random, functions: int, lines_per_function: int, error_rate: float) -> str:
+    lines = []
+    for _ in range(functions):
+        lines.append(f"def {_name(rng, rng.random() < error_rate)}(nums: list) -> int:")
+        lines.append('    """Adds the numbers."""')
+        lines += [f"    total_{index} = sum(nums) + {index}" for index in range(lines_per_function)]
+        lines += ["    return total_0", ""]
+    return "\n".join(lines)
+
+
+def _python_tests(rng: random.Random, tests: int, error_rate: float) -> str:
+    lines = []
+    for number in range(1, tests + 1):
+        if rng.random() >= error_rate:
+            lines.append(f"# Test Case {number}: Sum of {number} numbers")
+        lines += [f"assert sum_list(list(range({number}))) == {sum(range(number))}", ""]
+    return "\n".join(lines)
+
+
+def _python_unittest(rng: random.Random, tests: int, error_rate: float) -> str:
+    lines = ["import unittest", "", "class TestSumList(unittest.TestCase):"]
+    for number in range(1, tests + 1):
+        if rng.random() >= error_rate:
+            lines.append(f"    # Test Case {number}: Sum of {number} numbers")
+        lines += [f"    def test_sum_{number}(self):", f"        self.assertEqual(sum_list([{number}]), {number})", ""]
+    return "\n".join(lines)
+
+
+def _swift_code(rng: random.Random, functions: int, lines_per_function: int) -> str:
+    lines = []
+    for index in range(functions):
+        lines.append(f"func sumList{index}(nums: [Int]) -> Int {{")
+        lines += [f"    let total{line} = nums.reduce(0, +) + {line}" for line in range(lines_per_function)]
+        lines += ["    return total0", "}", ""]
+    return "\n".join(lines)
+
+
+def _swift_tests(rng: random.Random, tests: int, error_rate: float) -> str:
+    lines = []
+    for number in range(1, tests + 1):
+        if rng.random() >= error_rate:
+            lines.append(f"// Test Case {number}: Sum of {number} numbers")
+        lines += [f"assert(sumList0(nums: [{number}]) == {number})", ""]
+    return "\n".join(lines)
+
+
+def generate_notebook(
+    cells: int = 8,
+    cell_lines: int = 20,
+    tests: int = 10,
+    error_rate: float = 0.1,
+    examples: int = 3,
+    seed: int = 0,
+) -> NotebookNode:
+    """
+    Generate a Google Colab file with the structure of a task: the prompt, then Python and Swift
+    code and test blocks. The same arguments always generate the same notebook
+
+    :param cells: The amount of code cells after the prompt
+    :param cell_lines: The approximate amount of lines of each code cell
+    :param tests: The amount of test cases of each test cell
+    :param error_rate: The probability of each function name, test case comment and example header
+        being wrong
+    :param examples: The amount of examples of the prompt
+    :param seed: The seed of the random generator
+    :return: The notebook
+    """
+    rng = random.Random(seed)
+    functions = max(cell_lines // 8, 1)
+    lines_per_function = max(cell_lines // functions - 3, 1)
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells.append(nbformat.v4.new_markdown_cell(_prompt(rng, examples, error_rate)))
+    generators = [
+        lambda: _python_code(rng, functions, lines_per_function, error_rate),
+        lambda: _python_tests(rng, tests, error_rate),
+        lambda: _python_unittest(rng, tests, error_rate),
+        lambda: _swift_code(rng, functions, lines_per_function),
+        lambda: _swift_tests(rng, tests, error_rate),
+    ]
+    for index in range(cells):
+        notebook.cells.append(nbformat.v4.new_code_cell(generators[index % len(generators)]()))
+    return notebook